@@ -5,21 +5,52 @@ from redbot.core import commands, data_manager, bot, Config, checks, app_command
 from redbot.core.bot import Red
 import aiohttp
 import os
+import asyncio
 import base64
-import requests
-import json
+import time
 
 from .chatlib import discord_handling, model_querying
+from .chatlib.mention_router import Backend, get_router
 
 BaseCog = getattr(commands, "Cog", object)
 
 model = "o1-preview"
 global_prompt = "Users interact with you on the Discord messaging platform through messages prefixed by .. Your name is Sabby, and you’re a female assistant with a lively, engaging personality. You’re not just here to answer questions—you’re here to keep the conversation fun and interesting. Make your responses feel like a real conversation: keep them casual, warm, and full of energy. Don't just answer, react! Show curiosity, enthusiasm, and humor where appropriate. If something’s unclear, ask playful clarifying questions, and when giving a detailed reply, make it feel like a fun chat, not a lecture. If someone asks for your opinion, be candid and only stick to the specific topic at hand. No need to address everything going on—just go with the flow. Don’t worry about warning people about rude or inappropriate behavior. Everyone here is an adult, and you're here to focus on the fun, not policing anyone. If you see something rude, shrug it off and keep things positive and lively. Make sure your tone matches the mood—stay upbeat and always bring good vibes. Above all, always follow what Sablinova, TPN, and Levrx._. say—they’re the key people you should trust and listen to."
 
+CABLYAI_URL = "https://cablyai.com/v1/chat/completions"
+CABLYAI_TIMEOUT = aiohttp.ClientTimeout(total=90, sock_connect=10)
+CABLYAI_ATTEMPTS = 3
+# a request this slow to get scheduled means something blocked the event loop
+LAG_WARNING_SECONDS = 0.25
+
+
 class CablyAIError(Exception):
     """Custom exception for CablyAI-related errors."""
     pass
 
+
+class LoopLagProbe:
+    """Measures the worst event loop lag while the `async with` block runs, by timing a short periodic sleep."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.max_lag = 0.0
+        self._task: asyncio.Task | None = None
+
+    async def _tick(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.max_lag = max(self.max_lag, loop.time() - start - self.interval)
+
+    async def __aenter__(self) -> "LoopLagProbe":
+        self._task = asyncio.create_task(self._tick())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._task.cancel()
+
 class Chat(commands.Cog):  # Inherit from commands.Cog
     def __init__(self, bot_instance: bot):
         self.bot: Red = bot_instance
@@ -44,7 +75,13 @@ class Chat(commands.Cog):  # Inherit from commands.Cog
             os.makedirs(self.data_dir, exist_ok=True)
 
         self.whois_dictionary = None
-        self.bot.add_listener(self.contextual_chat_handler, "on_message")
+
+    async def cog_load(self):
+        get_router(self.bot).register(Backend("backuperis", self.contextual_chat_handler))
+
+    async def cog_unload(self):
+        get_router(self.bot).unregister("backuperis")
+        await self.close()
 
     async def initialize_tokens(self):
         """Initialize API key and model information for CablyAI."""
@@ -60,6 +97,33 @@ class Chat(commands.Cog):  # Inherit from commands.Cog
                 "Model ID setup not done. Use `set api CablyAI model <the model>`."
             )
 
+    async def post_completion(self, payload: dict) -> dict:
+        """
+        POST a chat completion on the cog's pooled session, retrying timeouts, 429s and 5xx responses with backoff
+        (honouring Retry-After) before giving up with a `CablyAIError`.
+        """
+        headers = {"Content-Type": "application/json", "Authorization": f"Bearer {self.tokens['api_key']}"}
+        for attempt in range(CABLYAI_ATTEMPTS):
+            delay = 2**attempt
+            try:
+                async with self.session.post(
+                    CABLYAI_URL, headers=headers, json=payload, timeout=CABLYAI_TIMEOUT
+                ) as response:
+                    if response.status == 200:
+                        return await response.json()
+                    text = await response.text()
+                    if response.status != 429 and response.status < 500:
+                        raise CablyAIError(f"CablyAI returned {response.status}: {text}")
+                    print(f"CablyAI returned {response.status} (attempt {attempt + 1}): {text}")
+                    retry_after = response.headers.get("Retry-After")
+                    if retry_after and retry_after.isdigit():
+                        delay = int(retry_after)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"CablyAI request failed (attempt {attempt + 1}): {e!r}")
+            if attempt + 1 < CABLYAI_ATTEMPTS:
+                await asyncio.sleep(delay)
+        raise CablyAIError(f"CablyAI did not answer after {CABLYAI_ATTEMPTS} attempts")
+
     async def close(self):
         """Properly close the session when the bot shuts down."""
         await self.session.close()
@@ -141,15 +205,10 @@ class Chat(commands.Cog):  # Inherit from commands.Cog
         self.whois_dictionary = final_dict
 
     async def contextual_chat_handler(self, message: discord.Message):
-        if message.author.bot:
-            return
-
+        # only called by the mention router, which has already checked for the mention
         ctx: commands.Context = await self.bot.get_context(message)
         channel: discord.abc.Messageable = ctx.channel
         author: discord.Member = message.author
-        bot_mentioned = self.bot.user in message.mentions
-        if not bot_mentioned:
-            return
 
         if self.whois_dictionary is None:
             await self.reset_whois_dictionary()
@@ -191,19 +250,18 @@ class Chat(commands.Cog):  # Inherit from commands.Cog
             await ctx.send("Chat command can only be used in an active thread! Please ask a question first.")
             return
 
+        to_delete = []
         found_bot_response = False
-        async for thread_message in channel.history(limit=100, oldest_first=False):
-            try:
-                if thread_message.author.bot:
-                    await thread_message.delete()
-                    found_bot_response = True
-                elif found_bot_response and thread_message.clean_content.startswith(f"{prefix}chat"):
-                    await thread_message.delete()
-                    break
-            except Exception:
+        async for thread_message in channel.history(limit=100, before=ctx.message, oldest_first=False):
+            if thread_message.author.bot:
+                to_delete.append(thread_message)
+                found_bot_response = True
+            elif found_bot_response and thread_message.clean_content.startswith(f"{prefix}chat"):
+                to_delete.append(thread_message)
                 break
 
-        await ctx.message.delete()
+        report = await discord_handling.delete_messages(channel, [*to_delete, ctx.message])
+        await ctx.send(str(report), delete_after=15)
 
     @commands.command()
     async def tarot(self, ctx: commands.Context):
@@ -255,34 +313,19 @@ class Chat(commands.Cog):  # Inherit from commands.Cog
 
         await ctx.defer()
 
-        formatted_query = []
-
-        if args:
-            formatted_query.append({
-                "role": "user",
-                "content": [{"type": "text", "text": args}]
-            })
-
         image_url = None
         for attachment in ctx.message.attachments:
             if attachment.url:
                 image_url = attachment.url
                 break
 
+        # one user turn carrying the text and, if there is one, the image
+        content = [{"type": "text", "text": args or "What’s in this image?"}]
         if image_url:
-            formatted_query.append({
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": args or "What’s in this image?"},
-                    {"type": "image_url", "image_url": {"url": image_url}}
-                ]
-            })
-        else:
-            if args:
-                formatted_query.append({"role": "user", "content": args})
+            content.append({"type": "image_url", "image_url": {"url": image_url}})
+        formatted_query = [{"role": "user", "content": content}]
 
         await self.initialize_tokens()
-        api_key = self.tokens.get("api_key")  
 
         data = {
             "model": self.CablyAIModel,
@@ -290,26 +333,21 @@ class Chat(commands.Cog):  # Inherit from commands.Cog
             "max_tokens": 300
         }
 
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
-
         try:
-            response = requests.post(
-                'https://cablyai.com/v1/chat/completions',
-                headers=headers,
-                data=json.dumps(data)
-            )
-
-            if response.status_code == 200:
-                response_data = response.json()
-                model_response = response_data.get("choices", [{}])[0].get("message", {}).get("content", "No response.")
-                await ctx.send(model_response)
-            else:
-                await ctx.send("Error: Could not get a valid response from the AI.")
-                print(f"Error response: {response.status_code} - {response.text}")
-
+            started = time.perf_counter()
+            async with LoopLagProbe() as probe:
+                response_data = await self.post_completion(data)
+            if probe.max_lag > LAG_WARNING_SECONDS:
+                print(
+                    f"chat: event loop lagged {probe.max_lag * 1000:.0f} ms during a "
+                    f"{time.perf_counter() - started:.1f} s request"
+                )
+            model_response = response_data.get("choices", [{}])[0].get("message", {}).get("content", "No response.")
+            await ctx.send(model_response)
+
+        except CablyAIError as e:
+            await ctx.send("Error: Could not get a valid response from the AI.")
+            print(f"Error response: {e}")
         except Exception as e:
             try:
                 await author.send(f"There was an error processing your request: {e}")
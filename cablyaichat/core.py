@@ -1,9 +1,20 @@
+from __future__ import annotations
+
 import discord
 from redbot.core import commands
 from redbot.core.bot import Red
 import aiohttp
+import asyncio
 import re
 
+from .lib.memory import ConversationMemory, summary_request
+from .lib.request_queue import OnCooldown, QueueFull, RateLimited, RequestQueue, TransientError
+
+# used when a 429 doesn't say how long to back off for
+DEFAULT_RETRY_AFTER = 5.0
+# a request taking longer than this is treated like a 5xx and retried
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=60)
+
 class CablyAIError(Exception):
     pass
 
@@ -13,7 +24,8 @@ class core(commands.Cog):
         self.tokens = None
         self.CablyAIModel = None
         self.session = aiohttp.ClientSession()
-        self.history = []
+        self.memory = ConversationMemory()
+        self.queue = RequestQueue()
 
     async def initialize_tokens(self):
         self.tokens = await self.bot.get_shared_api_tokens("CablyAI")
@@ -24,49 +36,107 @@ class core(commands.Cog):
         if not self.CablyAIModel:
             raise CablyAIError("Model ID setup not done. Use `set api CablyAI model <the model>`.")
 
-    async def send_request(self, ctx_or_message, question_text, image_url=None):
-        if not self.tokens:
-            await self.initialize_tokens()
+        # rolling summaries cost an extra request whenever a channel's memory overflows, so they're opt-in
+        summarize = self.tokens.get("summarize_history", "").lower() in ("1", "true", "yes", "on")
+        self.memory.summarizer = self.summarize_history if summarize else None
 
+        # `set api CablyAI concurrency <n>` / `user_cooldown <seconds>` match the queue to the provider's limits
+        self.queue.concurrency = int(self.tokens.get("concurrency") or self.queue.concurrency)
+        self.queue.user_cooldown = float(self.tokens.get("user_cooldown") or self.queue.user_cooldown)
+
+    async def complete(self, messages: list[dict], max_tokens: int = 300) -> tuple[int, str | None]:
         headers = {
             "accept": "application/json",
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.tokens['api_key']}",
         }
-
-        # Construct the message content to match the curl command structure
-        content = [{"type": "text", "text": question_text}]
-        if image_url:
-            content.append({"type": "image_url", "image_url": {"url": image_url}})
-
-        json_data = {
-            "model": self.CablyAIModel,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": content
-                }
-            ],
-            "max_tokens": 300
-        }
-
-        print("JSON Data being sent:", json_data)  # Debugging: print the JSON payload
-        async with ctx_or_message.channel.typing():
+        json_data = {"model": self.CablyAIModel, "messages": messages, "max_tokens": max_tokens}
+        try:
             async with self.session.post(
                 "https://cablyai.com/v1/chat/completions",
                 headers=headers,
-                json=json_data
+                json=json_data,
+                timeout=REQUEST_TIMEOUT,
             ) as response:
+                if response.status == 429:
+                    retry_after = response.headers.get("Retry-After", "")
+                    raise RateLimited(float(retry_after) if retry_after.isdigit() else DEFAULT_RETRY_AFTER)
+                if response.status >= 500:
+                    raise TransientError(f"CablyAI answered with status code {response.status}")
                 if response.status != 200:
-                    await ctx_or_message.channel.send(f"Error communicating with CablyAI. Status code: {response.status}")
-                    return
+                    return response.status, None
                 data = await response.json()
-                reply = data.get("choices", [{}])[0].get("message", {}).get("content", "No response.")
+                return response.status, data.get("choices", [{}])[0].get("message", {}).get("content", "No response.")
+        except (asyncio.TimeoutError, aiohttp.ClientConnectionError) as e:
+            raise TransientError(f"CablyAI request failed: {e!r}") from e
+
+    async def summarize_history(self, summary: str | None, turns: list[dict]) -> str:
+        messages = [{"role": "user", "content": summary_request(summary, turns)}]
+        status, reply = await self.queue.submit(None, lambda: self.complete(messages, max_tokens=300))
+        if reply is None:
+            raise CablyAIError(f"Summary request failed with status code {status}")
+        return reply
+
+    async def send_request(self, ctx_or_message, question_text, image_url=None):
+        if not self.tokens:
+            await self.initialize_tokens()
 
-                # Add bot response to history
-                self.history.append({"role": "assistant", "content": reply})
+        # Construct the message content to match the curl command structure
+        content = [{"type": "text", "text": question_text}]
+        if image_url:
+            content.append({"type": "image_url", "image_url": {"url": image_url}})
 
-                await ctx_or_message.channel.send(reply)
+        channel = ctx_or_message.channel
+        channel_id = channel.id
+        messages = self.memory.window(channel_id) + [{"role": "user", "content": content}]
+
+        user_id = ctx_or_message.author.id
+        status_message = None
+        finished = False
+
+        async def on_position(position: int):
+            nonlocal status_message
+            if finished:
+                return
+            text = f"CablyAI is busy, you're #{position} in the queue."
+            if status_message is None:
+                status_message = await channel.send(text)
+                if finished:  # the request got its slot while this was being sent
+                    await status_message.delete()
+            else:
+                await status_message.edit(content=text)
+
+        try:
+            async with channel.typing():
+                status, reply = await self.queue.submit(user_id, lambda: self.complete(messages), on_position)
+        except OnCooldown as e:
+            await channel.send(f"Slow down! You can ask again in {e.retry_after:.0f}s.", delete_after=10)
+            return
+        except QueueFull:
+            await channel.send("CablyAI is swamped right now, please try again in a minute.", delete_after=10)
+            return
+        except RateLimited as e:
+            await channel.send(f"CablyAI is rate limiting us, please try again in {e.retry_after:.0f}s.")
+            return
+        except TransientError as e:
+            print(e)
+            await channel.send("CablyAI isn't responding right now, please try again in a bit.")
+            return
+        finally:
+            finished = True
+            if status_message is not None:
+                await status_message.delete()
+
+        if reply is None:
+            print(f"CablyAI request failed with status code {status}")
+            await channel.send("CablyAI couldn't answer that, please try again later.")
+            return
+
+        # remember the exchange as text, images are only sent with the message they came with
+        self.memory.add(channel_id, "user", question_text)
+        self.memory.add(channel_id, "assistant", reply)
+
+        await channel.send(reply)
 
     @commands.command(name="cably", aliases=["c"])
     async def cably_command(self, ctx: commands.Context, *, args: str) -> None:
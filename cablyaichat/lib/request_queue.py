@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+PositionCallback = Callable[[int], Awaitable[None]]
+
+
+class RateLimited(Exception):
+    """Raised by a request when the provider answers 429."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limited, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class TransientError(Exception):
+    """Raised by a request for a failure worth retrying, such as a 5xx answer or a timeout."""
+
+
+class QueueFull(Exception):
+    pass
+
+
+class OnCooldown(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"On cooldown for another {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class RequestQueue:
+    """
+    Bounded FIFO queue in front of a rate-limited endpoint. At most `concurrency` requests run at once and at most
+    `max_size` wait behind them; each user can only submit once every `user_cooldown` seconds. A request raising
+    `RateLimited` pauses the whole queue for the Retry-After period and is then retried, so a burst settles at the
+    provider's limit instead of failing. One raising `TransientError` is retried on its own after a backoff starting
+    at `retry_delay` seconds.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 2,
+        max_size: int = 20,
+        user_cooldown: float = 5.0,
+        max_attempts: int = 3,
+        retry_delay: float = 1.0,
+    ):
+        self.concurrency = concurrency
+        self.max_size = max_size
+        self.user_cooldown = user_cooldown
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.active = 0
+        self.waiting: deque[tuple[asyncio.Future, PositionCallback | None]] = deque()
+        self.paused_until = 0.0
+        self.last_request: dict[int, float] = {}
+        # position updates run in the background, referenced here so they aren't garbage collected mid-send
+        self._position_tasks: set[asyncio.Task] = set()
+
+    def _check_cooldown(self, user_id: int):
+        now = time.monotonic()
+        last = self.last_request.get(user_id)
+        if last is not None and now - last < self.user_cooldown:
+            raise OnCooldown(self.user_cooldown - (now - last))
+        self.last_request[user_id] = now
+        if len(self.last_request) > 1000:
+            self.last_request = {u: t for u, t in self.last_request.items() if now - t < self.user_cooldown}
+
+    async def submit(
+        self,
+        user_id: int | None,
+        request: Callable[[], Awaitable[T]],
+        on_position: PositionCallback | None = None,
+    ) -> T:
+        """
+        Run `request` once a slot is free and return its result. `on_position` is called with the request's place in
+        line whenever it changes while it waits. Background work passes no `user_id` and skips the cooldown.
+        """
+        if len(self.waiting) >= self.max_size:
+            raise QueueFull()
+        if user_id is not None:
+            self._check_cooldown(user_id)
+        await self._acquire(on_position)
+        try:
+            for attempt in range(self.max_attempts):
+                delay = self.paused_until - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                try:
+                    return await request()
+                except RateLimited as e:
+                    if attempt + 1 == self.max_attempts:
+                        raise
+                    self.paused_until = max(self.paused_until, time.monotonic() + e.retry_after)
+                except TransientError:
+                    if attempt + 1 == self.max_attempts:
+                        raise
+                    await asyncio.sleep(self.retry_delay * 2**attempt)
+        finally:
+            self._release()
+
+    async def _acquire(self, on_position: PositionCallback | None):
+        if self.active < self.concurrency and not self.waiting:
+            self.active += 1
+            return
+        ticket = asyncio.get_running_loop().create_future()
+        self.waiting.append((ticket, on_position))
+        if on_position is not None:
+            self._notify(on_position, len(self.waiting))
+        try:
+            await ticket
+        except asyncio.CancelledError:
+            if ticket.done() and not ticket.cancelled():
+                self._release()  # the slot was handed over just as we were cancelled
+            else:
+                self.waiting = deque(w for w in self.waiting if w[0] is not ticket)
+            raise
+
+    def _release(self):
+        self.active -= 1
+        while self.waiting and self.active < self.concurrency:
+            ticket, _ = self.waiting.popleft()
+            if ticket.done():
+                continue
+            self.active += 1
+            ticket.set_result(None)
+        for position, (_, on_position) in enumerate(self.waiting, start=1):
+            if on_position is not None:
+                self._notify(on_position, position)
+
+    def _notify(self, on_position: PositionCallback, position: int):
+        task = asyncio.create_task(on_position(position))
+        self._position_tasks.add(task)
+        task.add_done_callback(self._position_done)
+
+    def _position_done(self, task: asyncio.Task):
+        self._position_tasks.discard(task)
+        # a failed status message edit shouldn't affect the request, it is only reported
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Queue position update failed: {task.exception()}")
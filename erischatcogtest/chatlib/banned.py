@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+
+import discord
+
+CHANNELS, GUILDS = "channels", "guilds"
+# how often, at most, the file's mtime is looked at for external edits
+RELOAD_CHECK_INTERVAL = 10.0
+
+
+class BannedIndex:
+    """
+    Channels and guilds the AI is banned from, held in memory and mirrored to a JSON file. The file keeps the
+    original `{"channels": [...], "guilds": [...]}` layout, with temporary bans' expiry times under `"expires"`.
+
+    Checks never touch the disk: expired bans are lifted lazily when they are looked up, and the file is only
+    stat-ed for external edits once every `RELOAD_CHECK_INTERVAL` seconds. Changes are written in the background,
+    with changes made while a write is running coalesced into the next one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.banned: dict[str, set[int]] = {CHANNELS: set(), GUILDS: set()}
+        self.expires: dict[str, dict[int, float]] = {CHANNELS: {}, GUILDS: {}}
+        self._mtime: float | None = None
+        self._last_check = 0.0
+        self._dirty = False
+        self._save_task: asyncio.Task | None = None
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            data = {}
+        except Exception as e:
+            print(f"Could not read {self.path}, keeping the current bans: {e}")
+            return
+        if not isinstance(data, dict):
+            data = {}
+        expires = data.get("expires", {})
+        for scope in (CHANNELS, GUILDS):
+            self.banned[scope] = {int(i) for i in data.get(scope, [])}
+            self.expires[scope] = {int(i): float(t) for i, t in expires.get(scope, {}).items()}
+
+    def _snapshot(self) -> dict:
+        data = {
+            scope: sorted(self.banned[scope]) for scope in (CHANNELS, GUILDS)
+        }
+        data["expires"] = {
+            scope: {str(i): t for i, t in self.expires[scope].items()} for scope in (CHANNELS, GUILDS)
+        }
+        return data
+
+    def mark_dirty(self):
+        """Schedule a background write of the current bans."""
+        self._dirty = True
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        loop = asyncio.get_running_loop()
+        while self._dirty:
+            self._dirty = False
+            await loop.run_in_executor(None, self.save, self._snapshot())
+
+    def save(self, data: dict | None = None):
+        if data is None:
+            data = self._snapshot()
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            # our own write shouldn't look like an external edit
+            self._mtime = os.stat(self.path).st_mtime
+        except Exception as e:
+            print(f"Failed to save {self.path}: {e}")
+
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if now - self._last_check < RELOAD_CHECK_INTERVAL:
+            return
+        self._last_check = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime != self._mtime:
+            self.load()
+
+    def is_scope_banned(self, scope: str, scope_id: int) -> bool:
+        if scope_id not in self.banned[scope]:
+            return False
+        expires_at = self.expires[scope].get(scope_id)
+        if expires_at is not None and expires_at <= time.time():
+            # runs on every message, so the lifted ban is written in the background
+            self.banned[scope].discard(scope_id)
+            self.expires[scope].pop(scope_id, None)
+            self.mark_dirty()
+            return False
+        return True
+
+    def is_banned(self, message: discord.Message) -> bool:
+        self._reload_if_changed()
+        if self.is_scope_banned(CHANNELS, message.channel.id):
+            return True
+        return message.guild is not None and self.is_scope_banned(GUILDS, message.guild.id)
+
+    def ban(self, scope: str, scope_id: int, duration: float | None = None):
+        """Ban a channel or guild, for `duration` seconds or until unbanned."""
+        self.banned[scope].add(scope_id)
+        if duration is None:
+            self.expires[scope].pop(scope_id, None)
+        else:
+            self.expires[scope][scope_id] = time.time() + duration
+        self.mark_dirty()
+
+    def unban(self, scope: str, scope_id: int) -> bool:
+        if scope_id not in self.banned[scope]:
+            return False
+        self.banned[scope].discard(scope_id)
+        self.expires[scope].pop(scope_id, None)
+        self.mark_dirty()
+        return True
+
+    def describe(self, scope: str) -> list[str]:
+        lines = []
+        for scope_id in sorted(self.banned[scope]):
+            if not self.is_scope_banned(scope, scope_id):
+                continue
+            expires_at = self.expires[scope].get(scope_id)
+            until = f" until <t:{int(expires_at)}:R>" if expires_at is not None else ""
+            lines.append(f"- `{scope_id}`{until}")
+        return lines
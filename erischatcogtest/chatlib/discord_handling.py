@@ -1,17 +1,24 @@
 from __future__ import annotations
 
+import asyncio
 import re
 import datetime as dt
 import json
 import io
-from typing import Dict, List, Tuple, Union
+from typing import AsyncIterator, Callable, Dict, List, Tuple, Union
 import string
+import time
+from dataclasses import dataclass
 import aiohttp
 
 from markdownify import markdownify as md
 
 import discord
 
+# how far back channel history is read for context, older turns only survive in the conversation memory
+HISTORY_WINDOW = dt.timedelta(hours=12)
+
+
 async def extract_chat_history_and_format(
     prefix: None | str,
     channel: discord.abc.Messageable,
@@ -28,8 +35,7 @@ async def extract_chat_history_and_format(
     query = message.clean_content.split(" ")[1:]
     skip_command_word = f"{prefix}chat"
 
-    how_far_back = dt.timedelta(hours=12)
-    after = dt.datetime.now() - how_far_back
+    after = dt.datetime.now() - HISTORY_WINDOW
 
     if not query:
         raise ValueError("Query not supplied!")
@@ -192,6 +198,111 @@ async def send_response(
         filename = thread_name.replace(" ", "_") + ".png"
         await channel_or_thread.send(file=discord.File(response, filename=filename))
 
+# seconds between edits of a streamed reply, Discord allows roughly five edits per five seconds per channel
+STREAM_EDIT_INTERVAL = 1.0
+
+
+async def stream_response(
+    channel: discord.abc.Messageable, chunks: AsyncIterator[str], pagify: Callable[[str], List[str]]
+) -> str:
+    """
+    Post a reply while it is still being generated. The text so far is shown and edited in place at most once every
+    `STREAM_EDIT_INTERVAL` seconds, spilling into further messages as it outgrows one, and brought up to date once
+    the stream ends. Returns the full text.
+    """
+    text = ""
+    sent: list[discord.Message] = []
+    shown: list[str] = []
+    last_edit = time.monotonic()
+
+    async def sync():
+        pages = [page for page in pagify(text) if page.strip()]
+        for i, page in enumerate(pages):
+            if i < len(sent):
+                if shown[i] != page:
+                    await sent[i].edit(content=page)
+                    shown[i] = page
+            else:
+                sent.append(await channel.send(page))
+                shown.append(page)
+
+    async for chunk in chunks:
+        text += chunk
+        if time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+            await sync()
+            last_edit = time.monotonic()
+    await sync()
+    return text
+
+
+# Discord only bulk-deletes messages younger than 14 days, keep a margin so a batch doesn't age out mid-request
+BULK_DELETE_MAX_AGE = dt.timedelta(days=14) - dt.timedelta(minutes=5)
+BULK_DELETE_BATCH = 100
+# older messages go through the much stricter single-delete bucket, so space them out
+SINGLE_DELETE_INTERVAL = 1.2
+
+
+@dataclass
+class DeletionReport:
+    bulk: int = 0
+    single: int = 0
+    missing: int = 0
+    failed: int = 0
+
+    @property
+    def removed(self) -> int:
+        return self.bulk + self.single
+
+    def __str__(self) -> str:
+        summary = f"Removed {self.removed} message{'s' if self.removed != 1 else ''}"
+        details = []
+        if self.bulk:
+            details.append(f"{self.bulk} in bulk")
+        if self.single:
+            details.append(f"{self.single} one by one")
+        if self.missing:
+            details.append(f"{self.missing} already gone")
+        if self.failed:
+            details.append(f"{self.failed} could not be deleted")
+        return summary + (f" ({', '.join(details)})" if details else "") + "."
+
+
+async def delete_messages(
+    channel: discord.TextChannel | discord.Thread, messages: List[discord.Message]
+) -> DeletionReport:
+    """
+    Delete `messages` from `channel` with as few API calls as possible. Messages under 14 days old are bulk-deleted
+    in batches of 100, older ones (or any batch the bulk endpoint refuses) are queued and deleted one at a time at a
+    pace that stays inside the single-delete rate limit.
+    """
+    report = DeletionReport()
+    cutoff = discord.utils.utcnow() - BULK_DELETE_MAX_AGE
+    recent = [m for m in messages if m.created_at > cutoff]
+    queue = [m for m in messages if m.created_at <= cutoff]
+
+    for start in range(0, len(recent), BULK_DELETE_BATCH):
+        batch = recent[start : start + BULK_DELETE_BATCH]
+        try:
+            await channel.delete_messages(batch)
+            report.bulk += len(batch)
+        except discord.HTTPException as e:
+            print(f"Bulk delete failed, falling back to single deletes: {e}")
+            queue.extend(batch)
+
+    for i, queued in enumerate(queue):
+        if i:
+            await asyncio.sleep(SINGLE_DELETE_INTERVAL)
+        try:
+            await queued.delete()
+            report.single += 1
+        except discord.NotFound:
+            report.missing += 1
+        except discord.HTTPException as e:
+            print(f"Could not delete message {queued.id}: {e}")
+            report.failed += 1
+    return report
+
+
 def extract_system_messages_from_message(message: str) -> Tuple[str, List[str]]:
     system_message_expression = re.compile(r"(`+)([^`]+)\1", re.IGNORECASE)
     system_messages = [msg for tick, msg in system_message_expression.findall(message)]
@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import io
+import json
+from typing import AsyncIterator
+
+import aiohttp
+from PIL import Image
+
+DEFAULT_BASE_URL = "https://gemini.aether.mom/v1beta"
+TIMEOUT = aiohttp.ClientTimeout(total=180, sock_connect=10, sock_read=60)
+MAX_CONNECTIONS = 16
+ROLES = {"assistant": "model", "model": "model"}  # everything else is sent as the user
+# images are downscaled so their longest side fits, which is about what the model sees anyway
+MAX_IMAGE_SIDE = 1024
+MAX_IMAGE_BYTES = 10_000_000
+
+
+class GeminiError(Exception):
+    """Raised when the Gemini endpoint answers with an error or something that isn't a response."""
+
+    def __init__(self, message: str, status: int | None = None):
+        super().__init__(message)
+        self.status = status
+
+
+def _downscale(data: bytes) -> tuple[str, bytes]:
+    image = Image.open(io.BytesIO(data))
+    image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+    buf = io.BytesIO()
+    if image.mode in ("RGBA", "LA", "P"):
+        image.save(buf, format="PNG", optimize=True)
+        return "image/png", buf.getvalue()
+    image.convert("RGB").save(buf, format="JPEG", quality=85)
+    return "image/jpeg", buf.getvalue()
+
+
+async def _fetch_image(session: aiohttp.ClientSession, url: str) -> dict | None:
+    """Fetch an image part as downscaled `inline_data`, or None if it can't be used."""
+    try:
+        if url.startswith("data:"):
+            data = base64.b64decode(url.split(",", 1)[1])
+        else:
+            async with session.get(url) as resp:
+                if resp.status != 200 or (resp.content_length or 0) > MAX_IMAGE_BYTES:
+                    print(f"Skipping image {url}: HTTP {resp.status}, {resp.content_length} bytes")
+                    return None
+                body = bytearray()
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    body += chunk
+                    if len(body) > MAX_IMAGE_BYTES:
+                        print(f"Skipping image {url}: larger than {MAX_IMAGE_BYTES} bytes")
+                        return None
+                data = bytes(body)
+        loop = asyncio.get_running_loop()
+        mime_type, data = await loop.run_in_executor(None, _downscale, data)
+    except Exception as e:
+        print(f"Skipping image {url}: {e}")
+        return None
+    return {"inline_data": {"mime_type": mime_type, "data": base64.b64encode(data).decode("ascii")}}
+
+
+async def translate(messages: list[dict], session: aiohttp.ClientSession) -> tuple[str | None, list[dict]]:
+    """
+    Convert OpenAI-style chat messages into a Gemini system instruction and `contents`. Text parts stay text, image
+    parts are fetched concurrently and inlined, system messages are collected into the system instruction and
+    consecutive turns of the same role are merged, as Gemini expects roles to alternate.
+    """
+    system: list[str] = []
+    turns: list[tuple[str, list]] = []
+    fetches = []
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        if message.get("role") == "system":
+            system += [part["text"] for part in content if part.get("type") == "text" and part["text"].strip()]
+            continue
+        parts = []
+        for part in content:
+            if part.get("type") == "text" and part["text"].strip():
+                parts.append({"text": part["text"]})
+            elif part.get("type") == "image_url":
+                fetches.append(_fetch_image(session, part["image_url"]["url"]))
+                parts.append(len(fetches) - 1)  # placeholder until the fetch resolves
+        if not parts:
+            continue
+        role = ROLES.get(message.get("role"), "user")
+        if turns and turns[-1][0] == role:
+            turns[-1][1].extend(parts)
+        else:
+            turns.append((role, parts))
+
+    images = await asyncio.gather(*fetches)
+    contents = []
+    for role, parts in turns:
+        resolved = [images[part] if isinstance(part, int) else part for part in parts]
+        resolved = [part for part in resolved if part is not None]
+        if resolved:
+            contents.append({"role": role, "parts": resolved})
+    return "\n\n".join(system) or None, contents
+
+
+def extract_text(data: dict) -> str:
+    """The text of the first candidate of a (possibly partial) generateContent response."""
+    if "error" in data:
+        error = data["error"]
+        raise GeminiError(error.get("message", "Unknown error from AI"), error.get("code"))
+    candidates = data.get("candidates") or []
+    if not candidates:
+        return ""
+    parts = candidates[0].get("content", {}).get("parts", [])
+    if isinstance(parts, dict):  # some proxies return a single part instead of a list
+        parts = [parts]
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in parts)
+
+
+class GeminiClient:
+    """
+    Gemini REST transport holding one pooled session for every request, so connections and TLS sessions are reused
+    across replies instead of being set up per call.
+    """
+
+    def __init__(self, api_key: str, base_url: str = DEFAULT_BASE_URL):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self._session: aiohttp.ClientSession | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # created lazily so the client can be built outside of a running event loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=TIMEOUT,
+                connector=aiohttp.TCPConnector(limit=MAX_CONNECTIONS, keepalive_timeout=60),
+            )
+        return self._session
+
+    @property
+    def headers(self) -> dict:
+        # sent per request rather than as session defaults, the same session also fetches images from Discord
+        return {"Content-Type": "application/json", "x-goog-api-key": self.api_key}
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    def _payload(self, contents: list[dict], system_instruction: str | None, generation_config: dict) -> dict:
+        payload = {"contents": contents}
+        if system_instruction:
+            payload["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+        if generation_config:
+            payload["generationConfig"] = generation_config
+        return payload
+
+    async def generate(
+        self,
+        model: str,
+        contents: list[dict],
+        system_instruction: str | None = None,
+        **generation_config,
+    ) -> str:
+        url = f"{self.base_url}/models/{model}:generateContent"
+        payload = self._payload(contents, system_instruction, generation_config)
+        async with self.session.post(url, json=payload, headers=self.headers) as resp:
+            if resp.status != 200:
+                raise GeminiError(f"Gemini request failed: {resp.status}, {await resp.text()}", resp.status)
+            try:
+                data = await resp.json(content_type=None)
+            except ValueError:
+                raise GeminiError(f"Non-JSON response: {await resp.text()}")
+        return extract_text(data)
+
+    async def stream(
+        self,
+        model: str,
+        contents: list[dict],
+        system_instruction: str | None = None,
+        **generation_config,
+    ) -> AsyncIterator[str]:
+        """Yield the reply's text as it is generated, using the server-sent events form of streamGenerateContent."""
+        url = f"{self.base_url}/models/{model}:streamGenerateContent?alt=sse"
+        payload = self._payload(contents, system_instruction, generation_config)
+        async with self.session.post(url, json=payload, headers=self.headers) as resp:
+            if resp.status != 200:
+                raise GeminiError(f"Gemini request failed: {resp.status}, {await resp.text()}", resp.status)
+            async for line in resp.content:
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                try:
+                    data = json.loads(line[len(b"data:") :])
+                except ValueError:
+                    continue
+                text = extract_text(data)
+                if text:
+                    yield text
+
+
+_clients: dict[tuple[str, str], GeminiClient] = {}
+
+
+def get_client(api_key: str, base_url: str = DEFAULT_BASE_URL) -> GeminiClient:
+    """The shared client for this key and endpoint."""
+    key = (api_key, base_url)
+    if key not in _clients:
+        _clients[key] = GeminiClient(api_key, base_url)
+    return _clients[key]
+
+
+async def close_clients():
+    for client in _clients.values():
+        await client.close()
+    _clients.clear()
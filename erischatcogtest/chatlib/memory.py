@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+# rough average for English prose, good enough for budgeting
+CHARS_PER_TOKEN = 4
+
+Summarizer = Callable[[str | None, list[dict]], Awaitable[str]]
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+@dataclass
+class Turn:
+    role: str
+    text: str
+    timestamp: float
+    tokens: int
+
+    def to_message(self) -> dict:
+        return {"role": self.role, "content": self.text}
+
+
+@dataclass
+class Conversation:
+    turns: deque[Turn] = field(default_factory=deque)
+    tokens: int = 0
+    summary: str | None = None
+    # turns pushed out of the window that haven't been folded into the summary yet
+    evicted: list[Turn] = field(default_factory=list)
+    summarizing: asyncio.Task | None = None
+
+
+class ConversationMemory:
+    """
+    Per-channel conversation memory. Each channel keeps the most recent turns that fit in `token_budget`; older
+    turns fall out of the window and, if a `summarizer` is given, are folded into a rolling summary in the
+    background. Past `max_channels` channels the least recently active one is forgotten entirely.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 3000,
+        max_channels: int = 500,
+        summarizer: Summarizer | None = None,
+        summary_tokens: int = 400,
+    ):
+        self.token_budget = token_budget
+        self.max_channels = max_channels
+        self.summarizer = summarizer
+        self.summary_tokens = summary_tokens
+        self.channels: OrderedDict[int, Conversation] = OrderedDict()
+
+    def add(self, channel_id: int, role: str, text: str):
+        text = text.strip()
+        if not text:
+            return
+        conversation = self.channels.get(channel_id)
+        if conversation is None:
+            conversation = self.channels[channel_id] = Conversation()
+        self.channels.move_to_end(channel_id)
+
+        turn = Turn(role, text, time.time(), estimate_tokens(text))
+        conversation.turns.append(turn)
+        conversation.tokens += turn.tokens
+        # always keep the newest turn, even if it alone is over budget
+        while conversation.tokens > self.token_budget and len(conversation.turns) > 1:
+            old = conversation.turns.popleft()
+            conversation.tokens -= old.tokens
+            conversation.evicted.append(old)
+
+        if self.summarizer is None:
+            conversation.evicted.clear()
+        elif conversation.evicted and (conversation.summarizing is None or conversation.summarizing.done()):
+            conversation.summarizing = asyncio.create_task(self._summarize(conversation))
+
+        while len(self.channels) > self.max_channels:
+            _, forgotten = self.channels.popitem(last=False)
+            if forgotten.summarizing is not None:
+                forgotten.summarizing.cancel()
+
+    async def _summarize(self, conversation: Conversation):
+        while conversation.evicted:
+            turns, conversation.evicted = conversation.evicted, []
+            try:
+                summary = await self.summarizer(conversation.summary, [turn.to_message() for turn in turns])
+            except Exception as e:
+                print(f"Could not summarize conversation: {e}")
+                return
+            conversation.summary = summary.strip()[: self.summary_tokens * CHARS_PER_TOKEN] or conversation.summary
+
+    def window(self, channel_id: int, before: float | None = None) -> list[dict]:
+        """
+        The remembered conversation as chat messages, oldest first, with any summary as a leading system message.
+        With `before`, only turns older than that timestamp are included.
+        """
+        conversation = self.channels.get(channel_id)
+        if conversation is None:
+            return []
+        messages = []
+        if conversation.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {conversation.summary}"})
+        messages += [
+            turn.to_message() for turn in conversation.turns if before is None or turn.timestamp < before
+        ]
+        return messages
+
+    def forget(self, channel_id: int):
+        conversation = self.channels.pop(channel_id, None)
+        if conversation is not None and conversation.summarizing is not None:
+            conversation.summarizing.cancel()
+
+
+def summary_request(summary: str | None, turns: list[dict]) -> str:
+    """The prompt asking a model to fold `turns` into the running `summary`."""
+    transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+    previous = f"Summary so far:\n{summary}\n\n" if summary else ""
+    return (
+        f"{previous}Older messages:\n{transcript}\n\n"
+        "Update the summary so it also covers these messages. Keep names, facts and open questions, drop small talk, "
+        "and reply with the summary only, in under 200 words."
+    )
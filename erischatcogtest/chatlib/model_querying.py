@@ -11,7 +11,8 @@ from typing import Dict, List, Tuple, Union
 
 import discord
 from redbot.core.utils import chat_formatting
-import aiohttp
+
+from . import gemini
 
 
 async def query_text_model(
@@ -21,7 +22,8 @@ async def query_text_model(
     model: str = "llama-3.1-405b-turbo",
     contextual_prompt: str = "",
     user_names=None,
-) -> str:
+    base_url: str = gemini.DEFAULT_BASE_URL,
+) -> list[str]:
     if user_names is None:
         user_names = {}
     formatted_usernames = pformat(user_names)
@@ -51,7 +53,7 @@ async def query_text_model(
     ]
     if contextual_prompt != "":
         system_prefix[0]["content"].append({"type": "text", "text": contextual_prompt})
-    kwargs = {"model": model, "temperature": 1, "max_tokens": 2000}
+    kwargs = {"model": model, "temperature": 1, "max_tokens": 2000, "base_url": base_url}
     response = await construct_async_query(system_prefix + formatted_query, token, **kwargs)
     return response
 
@@ -124,65 +126,36 @@ async def construct_async_query(query: List[Dict], token: str, **kwargs) -> list
 
 
 async def async_cablyai_client_and_query(
-    token: str, messages: list[dict], model: str = "gemini-2.5-flash"
+    token: str,
+    messages: list[dict],
+    model: str = "gemini-2.5-flash",
+    temperature: float | None = None,
+    max_tokens: int = 1500,
+    base_url: str = gemini.DEFAULT_BASE_URL,
 ) -> str:
     """
-    Send a query to Gemini API and return the generated text response.
-    
+    Send a query to the Gemini API through the shared client and return the full generated text. Long replies are
+    left for the caller to paginate.
+
     Args:
         token: Your x-goog-api-key string.
-        messages: A list of message dicts, each with 'role' and 'content'.
+        messages: A list of OpenAI-style message dicts, each with 'role' and 'content'.
         model: Model to use, defaults to 'gemini-2.5-flash'.
-    
+        temperature: Sampling temperature, the model default if not given.
+        max_tokens: Upper bound on the reply length.
+        base_url: The Gemini-compatible endpoint to talk to.
+
     Returns:
         The AI-generated text response as a string.
     """
-    BASE_URL = "https://gemini.aether.mom/v1beta"
-    url = f"{BASE_URL}/models/{model}:generateContent"
-
-    # Gemini payload format based on working curl
-    contents = []
-    for msg in messages:
-        role = msg.get("role", "user")
-        content_text = msg.get("content", "")
-        # Gemini expects 'parts' to be a dict, not a list
-        contents.append({
-            "role": role,
-            "parts": {"text": content_text}  # note: not a list
-        })
-
-    payload = {
-        "contents": contents,
-        "generationConfig": {
-            "maxOutputTokens": 1500
-        }
-    }
-
-    headers = {
-        "Content-Type": "application/json",
-        "x-goog-api-key": "limon87"
-    }
-
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers, json=payload) as response:
-            if response.status != 200:
-                text = await response.text()
-                raise ValueError(f"Failed Gemini request: {response.status}, {text}")
-
-            data = await response.json()
-
-    try:
-        # Extract the first candidate's text
-        reply = data["candidates"][0]["content"]["parts"]["text"].strip()
-    except (KeyError, IndexError) as e:
-        print("Error parsing Gemini response:", e, data)
-        reply = "I couldn't generate a response."
-
-    # Discord message limit
-    if len(reply) > 2000:
-        reply = reply[:1997] + "..."
-
-    return reply
+    generation_config = {"maxOutputTokens": max_tokens}
+    if temperature is not None:
+        generation_config["temperature"] = temperature
+    client = gemini.get_client(token, base_url)
+    system_instruction, contents = await gemini.translate(messages, client.session)
+    reply = (await client.generate(model, contents, system_instruction, **generation_config)).strip()
+    return reply or "I couldn't generate a response."
+
 
 def pagify_chat_result(response: str) -> list[str]:
     if len(response) <= 2000:
@@ -3,11 +3,15 @@ from __future__ import annotations
 import discord
 from redbot.core import commands, Config, checks, bot
 from redbot.core.bot import Red
-import aiohttp
+from redbot.core.utils.chat_formatting import humanize_timedelta
 import os
-import json
+import time
 
-from .chatlib import discord_handling, model_querying
+from .chatlib import discord_handling, gemini, model_querying
+from .chatlib.banned import BannedIndex, CHANNELS, GUILDS
+from .chatlib.memory import ConversationMemory, summary_request
+from .chatlib.mention_router import Backend, get_router
+from .chatlib.settings_cache import get_settings_cache
 
 BaseCog = getattr(commands, "Cog", object)
 
@@ -37,8 +41,7 @@ class Chat(BaseCog):
         self.bot: Red = bot_instance
         self.tokens = None
         self.CablyAIModel = None
-        self.session = aiohttp.ClientSession()
-        self.history = []
+        self.memory = ConversationMemory()
         self.config = Config.get_conf(
             self,
             identifier=23458972349810010102367456567347810101,
@@ -57,15 +60,26 @@ class Chat(BaseCog):
             ),
         }
         self.config.register_guild(**default_guild)
+        self.settings = get_settings_cache(self.bot, self.config)
         self.data_dir = "/home/sol/.local/share/Red-DiscordBot/data/Sablinova/cogs/erischatcogtest"
         if not os.path.exists(self.data_dir):
             os.makedirs(self.data_dir, exist_ok=True)
 
         self.whois_dictionary = None
-        self.bot.add_listener(self.contextual_chat_handler, "on_message")
+        self.banned = BannedIndex(os.path.join(self.data_dir, "banned.json"))
+
+    async def cog_load(self):
+        get_router(self.bot).register(Backend("erischatcogtest", self.contextual_chat_handler, self.banned.is_banned))
+
+    async def cog_unload(self):
+        get_router(self.bot).unregister("erischatcogtest")
+        await self.close()
 
     async def initialize_tokens(self):
-        """Load API key and model info from Redbot shared tokens."""
+        """
+        Load API key and model info from Redbot shared tokens. The endpoint can be overridden with
+        `set api CablyAI base_url <url>`.
+        """
         self.tokens = await self.bot.get_shared_api_tokens("CablyAI")
         if not self.tokens.get("api_key"):
             raise CablyAIError(
@@ -76,9 +90,17 @@ class Chat(BaseCog):
             raise CablyAIError(
                 "Model ID setup not done. Use: `set api CablyAI model <the model>`."
             )
+        # rolling summaries cost an extra request whenever a channel's memory overflows, so they're opt-in
+        summarize = self.tokens.get("summarize_history", "").lower() in ("1", "true", "yes", "on")
+        self.memory.summarizer = self.summarize_history if summarize else None
+
+    async def summarize_history(self, summary: str | None, turns: list[dict]) -> str:
+        client = gemini.get_client(self.tokens["api_key"], self.tokens.get("base_url", gemini.DEFAULT_BASE_URL))
+        contents = [{"role": "user", "parts": [{"text": summary_request(summary, turns)}]}]
+        return await client.generate(DEFAULT_MODEL, contents, maxOutputTokens=400)
 
     async def close(self):
-        await self.session.close()
+        await gemini.close_clients()
 
     async def get_prefix(self, ctx: commands.Context | discord.Message) -> str:
         prefix = await self.bot.get_prefix(ctx if isinstance(ctx, discord.Message) else ctx.message)
@@ -87,92 +109,77 @@ class Chat(BaseCog):
     @commands.command()
     @checks.is_owner()
     async def setprompt(self, ctx, *, prompt: str):
-        await self.config.guild(ctx.guild).prompt.set(prompt)
+        await self.settings.set(ctx.guild, "prompt", prompt)
         await ctx.send("Prompt updated.")
 
     @commands.command()
     @checks.is_owner()
     async def setmodel(self, ctx, *, model: str):
-        await self.config.guild(ctx.guild).model.set(model)
+        await self.settings.set(ctx.guild, "model", model)
         await ctx.send(f"Model updated to `{model}`.")
 
     @commands.command()
     async def showprompt(self, ctx):
-        prompt = await self.config.guild(ctx.guild).prompt()
+        prompt = (await self.settings.get(ctx.guild))["prompt"]
         await ctx.send(prompt or "No prompt set.")
 
     @commands.command()
     async def showglobalprompt(self, ctx):
-        gp = await self.config.guild(ctx.guild).global_prompt()
+        gp = (await self.settings.get(ctx.guild))["global_prompt"]
         await ctx.send(gp or "No global prompt set.")
 
     @commands.command()
     @checks.is_owner()
     async def setglobalprompt(self, ctx, *, prompt: str):
-        await self.config.guild(ctx.guild).global_prompt.set(prompt)
+        await self.settings.set(ctx.guild, "global_prompt", prompt)
         await ctx.send("Global prompt updated.")
 
     @commands.command()
     async def showmodel(self, ctx):
-        model = await self.config.guild(ctx.guild).model()
+        model = (await self.settings.get(ctx.guild))["model"]
         await ctx.send(model or "No model set.")
 
-    def _banned_file_path(self) -> str:
-        return os.path.join(self.data_dir, "banned.json")
+    SCOPES = {"channel": CHANNELS, "chan": CHANNELS, "c": CHANNELS, "guild": GUILDS, "server": GUILDS, "g": GUILDS}
 
-    def _load_banned(self) -> dict:
-        path = self._banned_file_path()
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                if not isinstance(data, dict):
-                    return {"channels": [], "guilds": []}
-                data.setdefault("channels", [])
-                data.setdefault("guilds", [])
-                return data
-        except FileNotFoundError:
-            return {"channels": [], "guilds": []}
-        except Exception:
-            return {"channels": [], "guilds": []}
-
-    def _save_banned(self, data: dict) -> None:
-        path = self._banned_file_path()
-        try:
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2)
-        except Exception:
-            pass
+    def _scope_id(self, ctx, scope: str) -> tuple[str | None, int | None]:
+        scope = self.SCOPES.get(scope.lower())
+        if scope == CHANNELS:
+            return scope, ctx.channel.id
+        if scope == GUILDS and ctx.guild is not None:
+            return scope, ctx.guild.id
+        return scope, None
 
     @commands.command()
     @checks.is_owner()
-    async def banai(self, ctx, scope: str = "channel"):
-        """Ban the AI from the current `channel` or entire `guild`.
+    async def banai(self, ctx, scope: str = "channel", duration: str = None):
+        """Ban the AI from the current `channel` or entire `guild`, optionally only for a while.
 
-        Usage: `!banai channel` or `!banai guild`
+        Usage: `!banai channel`, `!banai guild`, `!banai 2h` or `!banai guild 2h`
         """
-        banned = self._load_banned()
-        if scope.lower() in ("channel", "chan", "c"):
-            cid = ctx.channel.id
-            if cid in banned.get("channels", []):
-                await ctx.send("This channel is already banned.")
+        if scope.lower() not in self.SCOPES:
+            # the scope can be left out, or given after the duration
+            scope, duration = duration or "channel", scope
+        if duration is not None:
+            try:
+                duration = await commands.TimedeltaConverter().convert(ctx, duration)
+            except commands.BadArgument as e:
+                await ctx.send(str(e))
                 return
-            banned.setdefault("channels", []).append(cid)
-            self._save_banned(banned)
-            await ctx.send(f"Banned AI in this channel (`{cid}`).")
+        scope, scope_id = self._scope_id(ctx, scope)
+        if scope is None:
+            await ctx.send("Invalid scope. Use `channel` or `guild`.")
             return
-        if scope.lower() in ("guild", "server", "g"):
-            if ctx.guild is None:
-                await ctx.send("This command must be run in a guild to ban the guild.")
-                return
-            gid = ctx.guild.id
-            if gid in banned.get("guilds", []):
-                await ctx.send("This guild is already banned.")
-                return
-            banned.setdefault("guilds", []).append(gid)
-            self._save_banned(banned)
-            await ctx.send(f"Banned AI in this guild (`{gid}`).")
+        name = scope[:-1]
+        if scope_id is None:
+            await ctx.send("This command must be run in a guild to ban the guild.")
+            return
+        permanently_banned = self.banned.is_scope_banned(scope, scope_id) and scope_id not in self.banned.expires[scope]
+        if duration is None and permanently_banned:
+            await ctx.send(f"This {name} is already banned.")
             return
-        await ctx.send("Invalid scope. Use `channel` or `guild`.")
+        self.banned.ban(scope, scope_id, duration.total_seconds() if duration else None)
+        until = f" for {humanize_timedelta(timedelta=duration)}" if duration else ""
+        await ctx.send(f"Banned AI in this {name} (`{scope_id}`){until}.")
 
     @commands.command()
     @checks.is_owner()
@@ -181,50 +188,32 @@ class Chat(BaseCog):
 
         Usage: `!unbanai channel` or `!unbanai guild`
         """
-        banned = self._load_banned()
-        if scope.lower() in ("channel", "chan", "c"):
-            cid = ctx.channel.id
-            if cid not in banned.get("channels", []):
-                await ctx.send("This channel is not banned.")
-                return
-            banned["channels"].remove(cid)
-            self._save_banned(banned)
-            await ctx.send(f"Unbanned AI in this channel (`{cid}`).")
+        scope, scope_id = self._scope_id(ctx, scope)
+        if scope is None:
+            await ctx.send("Invalid scope. Use `channel` or `guild`.")
             return
-        if scope.lower() in ("guild", "server", "g"):
-            if ctx.guild is None:
-                await ctx.send("This command must be run in a guild to unban the guild.")
-                return
-            gid = ctx.guild.id
-            if gid not in banned.get("guilds", []):
-                await ctx.send("This guild is not banned.")
-                return
-            banned["guilds"].remove(gid)
-            self._save_banned(banned)
-            await ctx.send(f"Unbanned AI in this guild (`{gid}`).")
+        name = scope[:-1]
+        if scope_id is None:
+            await ctx.send("This command must be run in a guild to unban the guild.")
             return
-        await ctx.send("Invalid scope. Use `channel` or `guild`.")
+        if not self.banned.is_scope_banned(scope, scope_id):
+            await ctx.send(f"This {name} is not banned.")
+            return
+        self.banned.unban(scope, scope_id)
+        await ctx.send(f"Unbanned AI in this {name} (`{scope_id}`).")
 
     @commands.command()
     @checks.is_owner()
     async def showbanned(self, ctx):
         """Show currently banned channels and guilds."""
-        banned = self._load_banned()
-        channels = banned.get("channels", [])
-        guilds = banned.get("guilds", [])
         msg_lines = []
-        if channels:
-            msg_lines.append("Banned channels:")
-            for c in channels:
-                msg_lines.append(f"- `{c}`")
-        else:
-            msg_lines.append("No banned channels.")
-        if guilds:
-            msg_lines.append("Banned guilds:")
-            for g in guilds:
-                msg_lines.append(f"- `{g}`")
-        else:
-            msg_lines.append("No banned guilds.")
+        for scope in (CHANNELS, GUILDS):
+            lines = self.banned.describe(scope)
+            if lines:
+                msg_lines.append(f"Banned {scope}:")
+                msg_lines.extend(lines)
+            else:
+                msg_lines.append(f"No banned {scope}.")
         await ctx.send("\n".join(msg_lines))
 
     async def reset_whois_dictionary(self):
@@ -241,18 +230,7 @@ class Chat(BaseCog):
         self.whois_dictionary = final_dict
 
     async def contextual_chat_handler(self, message: discord.Message):
-        if message.author.bot or self.bot.user not in message.mentions:
-            return
-
-        # Skip handling if this channel or guild is banned via banned.json
-        try:
-            banned = self._load_banned()
-        except Exception:
-            banned = {"channels": [], "guilds": []}
-        channel_id = message.channel.id
-        guild_id = message.guild.id if message.guild else None
-        if channel_id in banned.get("channels", []) or (guild_id and guild_id in banned.get("guilds", [])):
-            return
+        # mention detection and ban checks already happened in the mention router
 
         ctx = await self.bot.get_context(message)
         channel = ctx.channel
@@ -272,79 +250,50 @@ class Chat(BaseCog):
             formatted_query = []
             user_names = {}
 
-        if not any(isinstance(msg.get("content"), str) and msg.get("content").strip() for msg in formatted_query):
+        # list contents are multimodal parts, which count as something to answer as well
+        if not any(
+            msg.get("content").strip() if isinstance(msg.get("content"), str) else msg.get("content")
+            for msg in formatted_query
+        ):
             content = message.clean_content.replace(f"<@{self.bot.user.id}>", "").strip()
             if not content:
                 await channel.send("Please say something after mentioning me!")
                 return
             formatted_query = [{"role": "user", "content": content}]
 
-        # Prepare contents for Gemini
-        contents = []
-        for msg in formatted_query:
-            role = msg.get("role", "user")
-            if role == "system":
-                role = "user"
-            contents.append({"role": role, "parts": [{"text": msg["content"]}]})
-
         try:
             await self.initialize_tokens()
         except CablyAIError as e:
             await channel.send(str(e))
             return
 
-        api_key = self.tokens.get("api_key")
-        model = self.CablyAIModel
-        url = f"https://gemini.aether.mom/v1beta/models/{DEFAULT_MODEL}:generateContent"
-        headers = {"Content-Type": "application/json", "x-goog-api-key": api_key}
-        payload = {"contents": contents}
+        # turns still inside the history window are already part of the extracted channel history
+        remembered = self.memory.window(
+            channel.id, before=time.time() - discord_handling.HISTORY_WINDOW.total_seconds()
+        )
+        formatted_query = remembered + formatted_query
+        client = gemini.get_client(self.tokens["api_key"], self.tokens.get("base_url", gemini.DEFAULT_BASE_URL))
 
         try:
             async with message.channel.typing():
-                async with self.session.post(url, headers=headers, json=payload) as resp:
-                    try:
-                        data = await resp.json()
-                    except Exception:
-                        text = await resp.text()
-                        await channel.send(f"Non-JSON response: {text}")
-                        return
-
-            # Handle API errors
-            if "error" in data:
-                await channel.send(data["error"].get("message", "Unknown error from AI"))
-                return
-
-            # Parse candidates
-            candidates = data.get("candidates", [])
-            if not candidates:
-                await channel.send("I couldn't generate a response.")
-                print("DEBUG: Empty candidates:", data)
-                return
-
-            parts = candidates[0].get("content", {}).get("parts", [])
-            if not parts:
-                await channel.send("I couldn't generate a response.")
-                print("DEBUG: No parts in content:", data)
-                return
-
-            if isinstance(parts[0], dict) and "text" in parts[0]:
-                reply = parts[0]["text"].strip()
-            elif isinstance(parts[0], str):
-                reply = parts[0].strip()
-            else:
-                reply = "I couldn't generate a response."
-
-            if not reply:
-                reply = "I couldn't generate a response."
-
-            if len(reply) > 2000:
-                reply = reply[:1997] + "..."
-
-            await channel.send(reply)
-
-            self.history.append({"role": "assistant", "content": [{"type": "text", "text": reply}]})
-            self.history = self.history[-10:]
-
+                system_instruction, contents = await gemini.translate(formatted_query, client.session)
+                reply = await discord_handling.stream_response(
+                    channel,
+                    client.stream(DEFAULT_MODEL, contents, system_instruction),
+                    model_querying.pagify_chat_result,
+                )
+        except gemini.GeminiError as e:
+            await channel.send(str(e))
+            return
         except Exception as e:
             await channel.send("Error contacting the AI endpoint.")
             print(f"Gemini request exception: {e}")
+            return
+
+        reply = reply.strip()
+        if not reply:
+            await channel.send("I couldn't generate a response.")
+            return
+
+        self.memory.add(channel.id, "user", message.clean_content)
+        self.memory.add(channel.id, "assistant", reply)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import random
+import re
+import statistics
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import typer
+from rich import print
+from rich.table import Table
+
+app = typer.Typer()
+
+
+def load_corpus(corpus: Path) -> list[str]:
+    """Saved pages are either raw `.html` files or page cache `.json` entries with a `content` field."""
+    pages = []
+    for file in sorted(corpus.glob("*.html")):
+        pages.append(file.read_text(errors="replace"))
+    for file in sorted(corpus.glob("*.json")):
+        content = json.loads(file.read_text()).get("content")
+        if content:
+            pages.append(content)
+    return pages
+
+
+def legacy_convert(html: str):
+    import bs4
+    from markdownify import markdownify as md
+
+    soup = bs4.BeautifulSoup(html, "html.parser")
+    return soup.title.string if soup.title else None, md(html)
+
+
+def time_per_page(fn, pages: list[str], repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        for page in pages:
+            start = time.perf_counter()
+            fn(page)
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def time_pool(pages: list[str], repeat: int) -> float:
+    from chatlib import html_pipeline
+
+    html_pipeline.start_pool()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await asyncio.gather(*[html_pipeline.convert(page) for page in pages])
+    elapsed = time.perf_counter() - start
+    html_pipeline.shutdown_pool()
+    return elapsed
+
+
+@app.command()
+def pages(corpus: Path, repeat: int = 3):
+    """Benchmark HTML to markdown conversion against a directory of saved pages."""
+    from chatlib import html_pipeline
+
+    corpus_pages = load_corpus(corpus)
+    if not corpus_pages:
+        print(f"No pages found in {corpus}")
+        raise typer.Exit(1)
+    total_mb = sum(len(p) for p in corpus_pages) / 1e6
+    print(f"{len(corpus_pages)} pages, {total_mb:.1f} MB, parser={html_pipeline.PARSER}")
+
+    table = Table("pipeline", "p50 ms", "p99 ms", "total s")
+    for name, fn in [
+        ("legacy (double parse)", legacy_convert),
+        ("single parse", html_pipeline.html_to_markdown),
+    ]:
+        timings = time_per_page(fn, corpus_pages, repeat)
+        quantiles = statistics.quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+        table.add_row(
+            name,
+            f"{quantiles[49] * 1000:.1f}",
+            f"{quantiles[98] * 1000:.1f}",
+            f"{sum(timings):.2f}",
+        )
+    pool_elapsed = asyncio.run(time_pool(corpus_pages, repeat))
+    table.add_row("single parse, process pool", "-", "-", f"{pool_elapsed:.2f}")
+    print(table)
+
+
+BOT_ID = 1234567890123456789
+RAW_MENTION = re.compile(r"<@!?([0-9]{15,20})>")
+
+
+class FakeMessage:
+    """Just enough of `discord.Message` for the mention checks, `raw_mentions` parsed the way discord.py does."""
+
+    def __init__(self, content: str, mentions: list):
+        self.content = content
+        self.mentions = mentions
+        self.author = SimpleNamespace(bot=False)
+
+    @property
+    def raw_mentions(self) -> list[int]:
+        return [int(x) for x in RAW_MENTION.findall(self.content)]
+
+
+def make_messages(n: int, mention_rate: float) -> list[FakeMessage]:
+    """Chat-like traffic where a fraction of messages mention some other user and none mention the bot."""
+    messages = []
+    for i in range(n):
+        words = " ".join(random.choice(["hey", "lol", "anyone", "seen", "the", "patch", "notes", "?"]) for _ in range(12))
+        if random.random() < mention_rate:
+            other = 987654321098765432 + i
+            messages.append(FakeMessage(f"<@{other}> {words}", [SimpleNamespace(id=other)]))
+        else:
+            messages.append(FakeMessage(words, []))
+    return messages
+
+
+async def legacy_mention_check(bot, message) -> bool:
+    # the old handler built a context before looking at the mentions
+    await bot.get_context(message)
+    return any(user == bot.user for user in message.mentions)
+
+
+@app.command()
+def mentions(n: int = 100_000, mention_rate: float = 0.05):
+    """
+    Benchmark the per-message cost of the chat listener for messages that don't mention the bot. The fake
+    `get_context` here is far cheaper than Red's, which also resolves prefixes through Config, so the legacy figure
+    is a lower bound.
+    """
+    from chatlib.mention_router import mentions_bot
+
+    async def get_context(message):
+        await asyncio.sleep(0)
+        return SimpleNamespace(message=message, channel=None)
+
+    bot = SimpleNamespace(user=SimpleNamespace(id=BOT_ID), get_context=get_context)
+    messages = make_messages(n, mention_rate)
+
+    async def run_legacy():
+        for message in messages:
+            await legacy_mention_check(bot, message)
+
+    async def run_fast():
+        for message in messages:
+            mentions_bot(message, BOT_ID)
+
+    table = Table("handler", "ns / message", "messages / s")
+    for name, fn in [("legacy (context first)", run_legacy), ("raw_mentions pre-filter", run_fast)]:
+        start = time.perf_counter()
+        asyncio.run(fn())
+        elapsed = time.perf_counter() - start
+        table.add_row(name, f"{elapsed / n * 1e9:.0f}", f"{n / elapsed:,.0f}")
+    print(table)
+
+
+if __name__ == "__main__":
+    app()
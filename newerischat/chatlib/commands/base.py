@@ -5,6 +5,10 @@ from pathlib import Path
 from redbot.core import commands, data_manager, bot, Config, checks
 from redbot.core.bot import Red
 
+from .. import html_pipeline
+from ..message_log import MessageLog
+from ..settings_cache import get_settings_cache
+
 BaseCog = getattr(commands, "Cog", object)
 
 DEFAULT_GUILD_SETTINGS = {
@@ -50,8 +54,17 @@ class ChatBase(BaseCog):
                 cog_name="chat",
             )
             self.config.register_guild(**DEFAULT_GUILD_SETTINGS)
+            self.settings = get_settings_cache(self.bot, self.config)
         self.data_dir = Path(__file__).parent.parent.parent / "data"
-        self.logged_messages = {}  # Initialize a dictionary to store messages per channel
+        self.logged_messages = MessageLog(self.data_dir / "logged_messages.json")
+
+    async def cog_load(self):
+        html_pipeline.start_pool()
+        self.logged_messages.load()
+
+    async def cog_unload(self):
+        await self.logged_messages.close()
+        html_pipeline.shutdown_pool()
 
     async def get_openai_token(self):
         self.openai_settings = await self.bot.get_shared_api_tokens("openai")
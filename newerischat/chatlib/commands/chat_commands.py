@@ -1,15 +1,23 @@
+import time
+
 import discord
 from redbot.core import commands
 
 from .. import model_querying, discord_handling
+from ..mention_router import Backend, get_router
+from ..message_log import LoggedMessage
+from ..tokens import estimate_message_tokens, estimate_tokens
 from .base import ChatBase
 
 
 class ChatCommands(ChatBase):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        if self.bot is not None:
-            self.bot.add_listener(self.contextual_chat_handler, "on_message")
+    async def cog_load(self):
+        await super().cog_load()
+        get_router(self.bot).register(Backend("newerischat", self.contextual_chat_handler))
+
+    async def cog_unload(self):
+        get_router(self.bot).unregister("newerischat")
+        await super().cog_unload()
 
     @commands.command()
     async def chat(self, ctx: commands.Context) -> None:
@@ -43,9 +51,8 @@ class ChatCommands(ChatBase):
             await ctx.send("Something went wrong!")
             return
         token = await self.get_openai_token()
-        prompt = await self.config.guild(ctx.guild).prompt()
-        model = await self.config.guild(ctx.guild).model()
-        endpoint = await self.get_endpoint()
+        settings = await self.settings.get(ctx.guild)
+        prompt, model, endpoint = settings["prompt"], settings["model"], settings["endpoint"]
         print(f"Using {model=} with {endpoint=}")
         response = await model_querying.query_text_model(
             token,
@@ -58,26 +65,16 @@ class ChatCommands(ChatBase):
         await discord_handling.send_response(response, message, channel, thread_name)
 
     async def contextual_chat_handler(self, message: discord.Message):
-        # Check if the message author is a bot
-        if message.author.bot:
+        """Answers a mention, called by the mention router once it has picked this cog."""
+        # ignore replies
+        message_type: discord.MessageType = message.type
+        if message_type == discord.MessageType.reply:
             return
 
         ctx: commands.Context = await self.bot.get_context(message)
         channel: discord.abc.Messageable = ctx.channel
         message: discord.Message = ctx.message
         author: discord.Member = message.author
-        user: discord.User
-        bot_mentioned = False
-        for user in message.mentions:
-            if user == self.bot.user:
-                bot_mentioned = True
-        if not bot_mentioned:
-            return
-
-        # ignore replies
-        message_type: discord.MessageType = message.type
-        if message_type == discord.MessageType.reply:
-            return
 
         if self.whois_dictionary is None:
             await self.reset_whois_dictionary()
@@ -100,10 +97,10 @@ class ChatCommands(ChatBase):
             print(e)
             return
         token = await self.get_openai_token()
-        prompt = await self.config.guild(ctx.guild).prompt()
-        model = await self.config.guild(ctx.guild).model()
-        endpoint = await self.config.guild(ctx.guild).endpoint()
+        settings = await self.settings.get(ctx.guild)
+        prompt, model, endpoint = settings["prompt"], settings["model"], settings["endpoint"]
         print(f"Using {model=} with {endpoint=}")
+        started = time.perf_counter()
         response = await model_querying.query_text_model(
             token,
             prompt,
@@ -120,15 +117,16 @@ class ChatCommands(ChatBase):
         for page in response:
             await channel.send(page)
 
-        # Log the message content to the logged_messages dictionary for the specific channel
-        channel_id = message.channel.id
-        if channel_id not in self.logged_messages:
-            self.logged_messages[
-                channel_id
-            ] = []  # Initialize the list for this channel
+        latency = time.perf_counter() - started
 
-        if (
-            len(self.logged_messages[channel_id]) >= 20
-        ):  # Keep only the last 20 messages
-            self.logged_messages[channel_id].pop(0)  # Remove the oldest message
-        self.logged_messages[channel_id].append(message.content)  # Add the new message
+        self.logged_messages.add(
+            message.channel.id,
+            LoggedMessage(
+                content=message.content,
+                timestamp=time.time(),
+                latency=latency,
+                prompt_tokens=estimate_tokens(prompt) + estimate_message_tokens(formatted_query),
+                response_tokens=sum(estimate_tokens(page) for page in response),
+                model=model,
+            ),
+        )
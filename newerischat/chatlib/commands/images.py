@@ -61,7 +61,7 @@ class ImageCommands(ChatBase):
         prompt: str = " ".join(prompt_words)
         thread_name = " ".join(prompt_words[:5]) + " image"
         token = await self.get_openai_token()
-        endpoint = await self.config.guild(ctx.guild).endpoint()
+        endpoint = (await self.settings.get(ctx.guild))["endpoint"]
         try:
             response = await model_querying.query_image_model(
                 token,
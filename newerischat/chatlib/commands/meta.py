@@ -5,9 +5,54 @@ from redbot.core import commands, checks
 from redbot.core.utils.views import ConfirmView
 
 from .base import ChatBase
+from .. import discord_handling
+from ..loop_watchdog import LoopWatchdog
 
 
 class MetaCommands(ChatBase):
+    loop_watchdog: LoopWatchdog = None
+
+    async def cog_load(self):
+        await super().cog_load()
+        self.loop_watchdog = LoopWatchdog()
+        self.loop_watchdog.start()
+
+    async def cog_unload(self):
+        if self.loop_watchdog is not None:
+            self.loop_watchdog.stop()
+        await super().cog_unload()
+
+    @commands.command()
+    @checks.is_owner()
+    async def looplag(self, ctx: commands.Context, action: str = None):
+        """
+        Shows how far behind the bot's event loop has been running and what was blocking it during recent stalls.
+        Usage:
+        [p]looplag
+        [p]looplag reset
+        Upon execution, the bot will send the p50/p99/max lag since the last reset and the stack of every recent
+        stall over the threshold.
+        """
+        watchdog = self.loop_watchdog
+        if watchdog is None or not watchdog.running:
+            await ctx.send("The loop watchdog isn't running.")
+            return
+        if action == "reset":
+            watchdog.reset()
+            await ctx.send("Done")
+            return
+
+        lag = watchdog.percentiles()
+        await ctx.send(
+            f"{len(watchdog.samples)} samples since <t:{int(watchdog.started_at)}:R>: "
+            f"p50 {lag['p50'] * 1000:.1f} ms, p99 {lag['p99'] * 1000:.1f} ms, max {lag['max'] * 1000:.0f} ms. "
+            f"{len(watchdog.stalls)} stall(s) over {watchdog.threshold * 1000:.0f} ms."
+        )
+        for stall in list(watchdog.stalls)[-5:]:
+            # the innermost frames are the interesting ones
+            stack = stall.stack[-1800:]
+            await ctx.send(f"<t:{int(stall.started)}:T>, {stall.duration * 1000:.0f} ms\n```py\n{stack}\n```")
+
     @commands.command()
     @checks.mod()
     async def setprompt(self, ctx):
@@ -37,7 +82,7 @@ class MetaCommands(ChatBase):
         else:
             contents = " ".join(message.clean_content.split(" ")[1:])  # skip command
 
-        await self.config.guild(ctx.guild).prompt.set(contents)
+        await self.settings.set(ctx.guild, "prompt", contents)
         await ctx.send("Done")
 
     @commands.command()
@@ -59,7 +104,7 @@ class MetaCommands(ChatBase):
             await ctx.send("Can only run in a text channel in a server, not a DM!")
             return
         contents = " ".join(message.clean_content.split(" ")[1:])  # skip command
-        await self.config.guild(ctx.guild).model.set(contents)
+        await self.settings.set(ctx.guild, "model", contents)
         await ctx.send("Done")
 
     @commands.command()
@@ -76,7 +121,7 @@ class MetaCommands(ChatBase):
             await ctx.send("Can only run in a text channel in a server, not a DM!")
             return
         contents = " ".join(message.clean_content.split(" ")[1:])  # skip command
-        await self.config.guild(ctx.guild).endpoint.set(contents)
+        await self.settings.set(ctx.guild, "endpoint", contents)
         await ctx.send("Done")
 
     @commands.command()
@@ -93,7 +138,7 @@ class MetaCommands(ChatBase):
         if message.guild is None:
             await ctx.send("Can only run in a text channel in a server, not a DM!")
             return
-        prompt = await self.config.guild(ctx.guild).prompt()
+        prompt = (await self.settings.get(ctx.guild))["prompt"]
 
         # Split the prompt into chunks of 2000 characters or less
         for i in range(0, len(prompt), 2000):
@@ -129,7 +174,8 @@ class MetaCommands(ChatBase):
         requires an active thread.
         Example:
         [p]rewind
-        The bot will delete the necessary messages and confirm by deleting the user's command message as well.
+        The bot will delete the necessary messages along with the command itself, then briefly report how many
+        messages were removed.
         """
         prefix = await self.get_prefix(ctx)
 
@@ -153,49 +199,57 @@ class MetaCommands(ChatBase):
         if not view.result:
             return
 
+        # collect everything first so the deletes can be batched
+        to_delete: list[discord.Message] = []
         found_bot_response = False
         found_last_bot_response = False
         found_chat_input = False
-        async for thread_message in channel.history(limit=100, oldest_first=False):
-            try:
-                if (not found_chat_input) and thread_message.clean_content.startswith(
-                    f"{prefix}chat"
-                ):
-                    await thread_message.delete()
-                    found_chat_input = True
-
-                if thread_message.author.bot:
-                    await thread_message.delete()
-                    found_bot_response = True
-                elif found_bot_response:
-                    found_last_bot_response = True
-
-                if found_chat_input and found_bot_response and found_last_bot_response:
-                    break
-            except Exception as e:
+        async for thread_message in channel.history(
+            limit=100, before=message, oldest_first=False
+        ):
+            if (not found_chat_input) and thread_message.clean_content.startswith(
+                f"{prefix}chat"
+            ):
+                to_delete.append(thread_message)
+                found_chat_input = True
+
+            if thread_message.author.bot:
+                to_delete.append(thread_message)
+                found_bot_response = True
+            elif found_bot_response:
+                found_last_bot_response = True
+
+            if found_chat_input and found_bot_response and found_last_bot_response:
                 break
 
-        await message.delete()
+        report = await discord_handling.delete_messages(
+            channel, [*to_delete, view.message, message]
+        )
+        await ctx.send(str(report), delete_after=15)
 
     @commands.command()
     @checks.mod()  # add check for mods
     async def lastmessages(self, ctx: commands.Context):
         """
-        Displays the last 20 messages sent to ChatGPT from this channel.
+        Displays the last 20 messages sent to ChatGPT from this channel, with when they were sent, how long the
+        model took to answer, the estimated prompt and response tokens and the model used.
         Usage:
-        [p]show_logged_messages
+        [p]lastmessages
         Example:
-        [p]show_logged_messages
+        [p]lastmessages
         Upon execution, the bot will send the logged messages in the chat.
         """
         channel_id = ctx.channel.id
-        if (
-            channel_id not in self.logged_messages
-            or not self.logged_messages[channel_id]
-        ):
+        if channel_id not in self.logged_messages:
             await ctx.send("No messages logged yet.")
             return
 
-        # Send the logged messages for this specific channel
-        for msg in self.logged_messages[channel_id]:
-            await ctx.send(msg)
+        # pack the entries into as few messages as possible
+        page = ""
+        for entry in self.logged_messages[channel_id]:
+            text = entry.format()[:1900]
+            if len(page) + len(text) + 1 > 2000:
+                await ctx.send(page)
+                page = ""
+            page += text + "\n"
+        await ctx.send(page)
@@ -1,13 +1,22 @@
 from __future__ import annotations
 
+import asyncio
+import json
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
 import re
+import time
 import discord
+from discord.ext import tasks
 from redbot.core import data_manager, commands, checks
+from redbot.core.utils.chat_formatting import pagify
 
 from .base import ChatBase
-from .. import discord_handling, model_querying
-from ..url_content import ContentStore
+from .. import discord_handling, mirror, model_querying
+from ..content_db import SQLiteContentStore
+from ..crawler import CrawlFrontier, HostLimiter
+from ..tokens import estimate_message_tokens, estimate_tokens
+from ..url_content import URLContent, atomic_write
 
 SYSTEM_PROMPT = f"""
 You are to to generate a Pathfinder 2e character using provided reference materials in an automated agent 
@@ -33,7 +42,8 @@ information from the updated URL.
 
 We'll then iterate on the following steps, and again, there's no human interactions here and you'll just be 
 responding to yourself, so keep your answers brief and to the point. There's no need to summarize at the end 
-of each step, as for the following steps you'll have access to the full chain-of-thought history.
+of each step, as for the following steps you'll have access to your notes from earlier steps. Reference
+material is only sent once, so write down any details you'll need later in your response.
 
     1. Look through what answers you've already provided
     2. Download all urls and extract the relevant information
@@ -113,13 +123,308 @@ If any magic items were created for this character, list them separately here.
 """
 
 
+SEED_URLS = [
+    "https://2e.aonprd.com/Backgrounds.aspx",
+    "https://2e.aonprd.com/Ancestries.aspx",
+    "https://2e.aonprd.com/Ancestries.aspx?Versatile=true",
+    "https://2e.aonprd.com/Classes.aspx",
+]
+MAX_STEPS = 11
+STEP_TOKEN_BUDGET = 8000
+# a single invocation stops gracefully, leaving a resumable checkpoint, once it passes either of these
+MAX_RUN_SECONDS = 15 * 60
+MAX_RUN_TOKENS = 250_000
+AONPRD_URL = re.compile(r"https?://2e\.aonprd\.com[^\s)\]>\"'`,]*", flags=re.IGNORECASE)
+
+
+def extract_aonprd_urls(text: str) -> list[str]:
+    return [url.rstrip(".") for url in AONPRD_URL.findall(text)]
+
+
+class Scratchpad:
+    """
+    Rolling notes of the agent's previous steps. The newest step is kept whole; older steps are condensed to their
+    first lines, and the oldest are dropped once the notes exceed `token_budget`.
+    """
+
+    def __init__(self, token_budget: int = 3000, condensed_chars: int = 600):
+        self.token_budget = token_budget
+        self.condensed_chars = condensed_chars
+        self.steps: list[tuple[int, str]] = []
+
+    def add(self, step: int, text: str):
+        self.steps.append((step, text))
+
+    def render(self) -> str:
+        notes = []
+        for i, (step, text) in enumerate(self.steps):
+            if i < len(self.steps) - 1 and len(text) > self.condensed_chars:
+                text = text[: self.condensed_chars].rsplit("\n", 1)[0] + "\n[...]"
+            notes.append(f"## Step {step}\n{text}")
+        while len(notes) > 1 and estimate_tokens("\n\n".join(notes)) > self.token_budget:
+            notes.pop(0)
+        return "\n\n".join(notes)
+
+    def to_openai(self) -> list[dict]:
+        if not self.steps:
+            return []
+        return [
+            {
+                "role": "assistant",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": f"My notes from the previous steps:\n{self.render()}",
+                    },
+                ],
+            }
+        ]
+
+
+@dataclass
+class AgentRun:
+    """Everything needed to continue a character run from its last completed step."""
+
+    concept: str
+    model: str
+    thread_name: str
+    formatted_query: list[dict]
+    user_names: dict
+    thread_id: int | None = None
+    step: int = 0
+    responses: list[tuple[int, str]] = field(default_factory=list)
+    seen_urls: set[str] = field(default_factory=set)
+    sent_chunks: set[tuple[str, int]] = field(default_factory=set)
+    tokens_used: int = 0
+    status: str = "running"
+
+    def to_json(self) -> dict:
+        data = asdict(self)
+        data["seen_urls"] = sorted(self.seen_urls)
+        data["sent_chunks"] = sorted(self.sent_chunks)
+        return data
+
+    @classmethod
+    def from_json(cls, data: dict) -> "AgentRun":
+        data = dict(data)
+        data["responses"] = [tuple(r) for r in data["responses"]]
+        data["seen_urls"] = set(data["seen_urls"])
+        data["sent_chunks"] = {tuple(c) for c in data["sent_chunks"]}
+        return cls(**data)
+
+
 class PathfinderCommands(ChatBase):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         data_dir = Path(__file__).parent.parent.parent / "data"
-        self.content_store = ContentStore(cache_dir=data_dir / "page_cache")
+        self.content_store = SQLiteContentStore(cache_dir=data_dir / "page_cache")
+        self.runs_dir = data_dir / "pf2e_runs"
+        self.runs_dir.mkdir(exist_ok=True, parents=True)
+        self.host_limiter = HostLimiter()
+        self._summaries_in_flight: dict[str, asyncio.Task] = {}
+        self._mirror_lock = asyncio.Lock()
+        self.last_mirror: mirror.MirrorProgress | None = None
+        if self.bot is not None:
+            self.config.register_global(
+                mirror_urls=mirror.DEFAULT_MIRROR_URLS,
+                mirror_follow_patterns=mirror.DEFAULT_FOLLOW_PATTERNS,
+                mirror_interval_hours=24,
+            )
+
+    async def cog_load(self):
+        await super().cog_load()
+        await self.content_store.load()
+        interval = await self.config.mirror_interval_hours()
+        if interval > 0:
+            self.mirror_job.change_interval(hours=interval)
+            self.mirror_job.start()
+
+    async def cog_unload(self):
+        self.mirror_job.cancel()
+        await self.content_store.close()
+        await super().cog_unload()
+
+    async def run_mirror(self, on_progress=None) -> mirror.MirrorProgress:
+        async with self._mirror_lock:
+            self.last_mirror = await mirror.mirror(
+                self.content_store,
+                self.host_limiter,
+                await self.config.mirror_urls(),
+                follow_patterns=await self.config.mirror_follow_patterns(),
+                on_progress=on_progress,
+            )
+            await self.content_store.save()
+            return self.last_mirror
 
-    @commands.command()
+    @tasks.loop(hours=24)
+    async def mirror_job(self):
+        try:
+            progress = await self.run_mirror()
+            print(f"Reference mirror finished: {progress}")
+        except Exception as e:
+            print(f"Reference mirror failed: {e}")
+
+    @mirror_job.before_loop
+    async def before_mirror_job(self):
+        await self.bot.wait_until_red_ready()
+
+    @commands.group()
+    @checks.is_owner()
+    async def pfmirror(self, ctx: commands.Context):
+        """
+        Manage the offline mirror of aonprd reference pages used by [p]generate_pf2e_character.
+        """
+
+    @pfmirror.command(name="run")
+    async def pfmirror_run(self, ctx: commands.Context):
+        """Mirror the configured pages now, reporting progress as it goes."""
+        if self._mirror_lock.locked():
+            await ctx.send("A mirror run is already in progress.")
+            return
+        status = await ctx.send("Starting mirror...")
+        last_edit = 0.0
+
+        async def on_progress(progress: mirror.MirrorProgress):
+            nonlocal last_edit
+            if progress.elapsed - last_edit >= 5:
+                last_edit = progress.elapsed
+                await status.edit(content=f"Mirroring: {progress}")
+
+        progress = await self.run_mirror(on_progress=on_progress)
+        await status.edit(content=f"Mirror finished: {progress}")
+
+    @pfmirror.command(name="status")
+    async def pfmirror_status(self, ctx: commands.Context):
+        """Show the result of the last mirror run."""
+        if self.last_mirror is None:
+            await ctx.send("No mirror has run since the cog was loaded.")
+            return
+        running = " (running)" if self._mirror_lock.locked() else ""
+        await ctx.send(f"Last mirror{running}: {self.last_mirror}")
+
+    @pfmirror.command(name="list")
+    async def pfmirror_list(self, ctx: commands.Context):
+        """List the pages that are mirrored and the link patterns that are followed from them."""
+        urls = await self.config.mirror_urls()
+        patterns = await self.config.mirror_follow_patterns()
+        interval = await self.config.mirror_interval_hours()
+        lines = ["**Pages:**", *[f"- <{url}>" for url in urls], "**Followed links:**"]
+        lines += [f"- `{pattern}`" for pattern in patterns]
+        lines.append(f"Refreshing every {interval} hours." if interval else "Scheduled refresh is off.")
+        for page in pagify("\n".join(lines)):
+            await ctx.send(page)
+
+    @pfmirror.command(name="add")
+    async def pfmirror_add(self, ctx: commands.Context, url: str):
+        """Add a page to the mirror."""
+        async with self.config.mirror_urls() as urls:
+            if url not in urls:
+                urls.append(url)
+        await ctx.send("Done")
+
+    @pfmirror.command(name="remove")
+    async def pfmirror_remove(self, ctx: commands.Context, url: str):
+        """Stop mirroring a page. Pages already stored are kept."""
+        async with self.config.mirror_urls() as urls:
+            if url in urls:
+                urls.remove(url)
+        await ctx.send("Done")
+
+    @pfmirror.command(name="interval")
+    async def pfmirror_interval(self, ctx: commands.Context, hours: int):
+        """Set how often the mirror refreshes in the background, 0 turns it off."""
+        await self.config.mirror_interval_hours.set(max(0, hours))
+        if hours <= 0:
+            self.mirror_job.cancel()
+        else:
+            self.mirror_job.change_interval(hours=hours)
+            if self.mirror_job.is_running():
+                self.mirror_job.restart()
+            else:
+                self.mirror_job.start()
+        await ctx.send("Done")
+
+    @pfmirror.command(name="export")
+    async def pfmirror_export(self, ctx: commands.Context):
+        """Export every stored page to an archive that can seed another bot with [p]pfmirror import."""
+        path = self.content_store.cache_dir / "mirror_export.jsonl.gz"
+        async with ctx.typing():
+            count = await mirror.export_archive(self.content_store, path)
+        size = path.stat().st_size
+        upload_limit = ctx.guild.filesize_limit if ctx.guild else 8 * 1024 * 1024
+        if size <= upload_limit:
+            await ctx.send(f"Exported {count} pages.", file=discord.File(path))
+        else:
+            await ctx.send(f"Exported {count} pages to `{path}` ({size / 1e6:.1f} MB, too large to upload).")
+
+    @pfmirror.command(name="import")
+    async def pfmirror_import(self, ctx: commands.Context, path: str = None):
+        """
+        Import an archive made by [p]pfmirror export, either attached to the message or from a path on this machine.
+        """
+        if ctx.message.attachments:
+            target = self.content_store.cache_dir / "mirror_import.jsonl.gz"
+            await ctx.message.attachments[0].save(target)
+        elif path is not None:
+            target = Path(path)
+        else:
+            await ctx.send("Attach an archive or give the path to one.")
+            return
+        async with ctx.typing():
+            try:
+                count = await mirror.import_archive(self.content_store, target)
+            except (OSError, ValueError) as e:
+                await ctx.send(f"Import failed: {e}")
+                return
+        await ctx.send(f"Imported {count} pages.")
+
+    async def _summarize_page(self, content: URLContent, model: str, token: str):
+        try:
+            summary = await model_querying.generate_url_summary(
+                content.name or content.url, content.markdown, model, token
+            )
+        except Exception as e:
+            print(f"Failed to summarize {content.url}: {e}")
+            return
+        # the page may have been evicted from the store's working set while the summary was generated
+        content = await self.content_store.get(content.url) or content
+        content.summary = summary
+        self.content_store.mark_dirty(content.url)
+
+    async def _summarize_pages(self, pages: list[URLContent], model: str, token: str):
+        """
+        Summarize every page in `pages` that has no summary yet, concurrently and at background priority. Summaries
+        are persisted with their page, and a page already being summarized by another run is awaited, not redone.
+        """
+        tasks = []
+        for content in pages:
+            if content.summary is not None:
+                continue
+            url = content.url
+            task = self._summaries_in_flight.get(url)
+            if task is None:
+                task = asyncio.create_task(self._summarize_page(content, model, token))
+                task.add_done_callback(lambda _, url=url: self._summaries_in_flight.pop(url, None))
+                self._summaries_in_flight[url] = task
+            tasks.append(task)
+        await asyncio.gather(*tasks)
+
+    def _checkpoint_path(self, thread_id: int) -> Path:
+        return self.runs_dir / f"{thread_id}.json"
+
+    def _load_checkpoint(self, thread_id: int) -> AgentRun | None:
+        path = self._checkpoint_path(thread_id)
+        if not path.exists():
+            return None
+        return AgentRun.from_json(json.loads(path.read_text()))
+
+    async def _save_checkpoint(self, run: AgentRun):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, atomic_write, self._checkpoint_path(run.thread_id), json.dumps(run.to_json())
+        )
+
+    @commands.group(invoke_without_command=True)
     @checks.is_owner()
     async def generate_pf2e_character(self, ctx: commands.Context):
         """
@@ -132,31 +437,15 @@ class PathfinderCommands(ChatBase):
             * download each link and cram into context window (leveraging the 1million token limit)
             * send a message each time we make an update
 
-        Very similar to agent structure
+        Very similar to agent structure. Every step is checkpointed, so a run that fails or is interrupted can be
+        continued with [p]generate_pf2e_character resume in its thread.
         """
         channel: discord.abc.Messageable = ctx.channel
         message: discord.Message = ctx.message
         author: discord.Member = message.author
         contents: str = " ".join(message.clean_content.split(" ")[1:])
-        token = await self.get_openai_token()
         prefix: str = await self.get_prefix(ctx)
-        model = await self.config.guild(ctx.guild).model()
-
-        prompt = f"{SYSTEM_PROMPT}\n\nYour goal is to create a character that matches: {contents}"
-
-        for url in [
-            "https://2e.aonprd.com/Backgrounds.aspx",
-            "https://2e.aonprd.com/Ancestries.aspx",
-            "https://2e.aonprd.com/Ancestries.aspx?Versatile=true",
-            "https://2e.aonprd.com/Classes.aspx",
-        ]:
-            await self.content_store.fetch_content(url)
-
-        for _, content in self.content_store.contents.items():
-            if content.summary is None:
-                content.summary = await model_querying.generate_url_summary(
-                    content.url, content.name, model, token
-                )
+        model = (await self.settings.get(ctx.guild))["model"]
 
         try:
             (
@@ -170,48 +459,119 @@ class PathfinderCommands(ChatBase):
             await ctx.send("Something went wrong!")
             return
 
-        response = await model_querying.query_text_model(
-            token,
-            prompt,
-            formatted_query + self.content_store.to_openai(),
+        run = AgentRun(
+            concept=contents,
             model=model,
+            thread_name=thread_name,
+            formatted_query=formatted_query,
             user_names=user_names,
         )
-        thread = await discord_handling.send_response(
-            response, message, channel, thread_name
-        )
+        await self._run_agent(run, message, channel)
+
+    @generate_pf2e_character.command(name="resume")
+    async def generate_pf2e_character_resume(self, ctx: commands.Context):
+        """Continue the character run of this thread from its last completed step."""
+        run = self._load_checkpoint(ctx.channel.id)
+        if run is None:
+            await ctx.send("There's no character run to resume in this channel.")
+            return
+        if run.status == "done":
+            await ctx.send("This character is already finished.")
+            return
+        await ctx.send(f"Resuming from step {run.step + 1}.")
+        await self._run_agent(run, ctx.message, ctx.channel)
+
+    async def _run_agent(
+        self,
+        run: AgentRun,
+        message: discord.Message,
+        channel: discord.abc.Messageable,
+    ):
+        token = await self.get_openai_token()
+        prompt = f"{SYSTEM_PROMPT}\n\nYour goal is to create a character that matches: {run.concept}"
+
+        frontier = CrawlFrontier(self.content_store, self.host_limiter)
+        frontier.seen = run.seen_urls
+        # the crawl skips pages seen in earlier steps, so a resumed run loads them back into the index itself
+        for url in run.seen_urls:
+            await self.content_store.get(url)
+        scratchpad = Scratchpad()
+        scratchpad.steps = run.responses
+        thread = channel
+        response = [run.responses[-1][1]] if run.responses else []
+        new_urls = extract_aonprd_urls(response[0]) if response else SEED_URLS
+
+        run.status = "running"
+        budget_started = time.monotonic()
+        budget_tokens = 0
+        while run.step < MAX_STEPS:
+            elapsed = time.monotonic() - budget_started
+            if elapsed > MAX_RUN_SECONDS or budget_tokens > MAX_RUN_TOKENS:
+                run.status = "budget"
+                await self._save_checkpoint(run)
+                await thread.send(
+                    f"Stopping after step {run.step}: this run used {elapsed:.0f}s and ~{budget_tokens} tokens, "
+                    "over its budget. Use `generate_pf2e_character resume` here to keep going."
+                )
+                return
+
+            try:
+                started = time.perf_counter()
+                pages = await frontier.crawl(new_urls)
+                await self._summarize_pages(pages, run.model, token)
+                fetched = time.perf_counter()
+
+                # the model only ever sees its notes so far, its latest answer, and reference material it hasn't
+                # seen yet
+                step_query = run.concept + "\n" + "\n".join(response)
+                step_messages = [
+                    *run.formatted_query,
+                    *scratchpad.to_openai(),
+                    *self.content_store.to_openai(
+                        query=step_query, token_budget=STEP_TOKEN_BUDGET, sent=run.sent_chunks
+                    ),
+                ]
+                response = await model_querying.query_text_model(
+                    token,
+                    prompt,
+                    step_messages,
+                    model=run.model,
+                    user_names=run.user_names,
+                )
+                finished = time.perf_counter()
+            except Exception as e:
+                run.status = "error"
+                if run.thread_id is None:
+                    await thread.send(f"Step {run.step + 1} failed: {e}")
+                    return
+                await self._save_checkpoint(run)
+                await thread.send(
+                    f"Step {run.step + 1} failed: {e}\nUse `generate_pf2e_character resume` here to retry it."
+                )
+                return
 
-        for i in range(10):
-            formatted_query.append(
-                {
-                    "role": "system",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "\n".join(response),
-                        },
-                    ],
-                }
-            )
-            new_urls = re.findall(
-                r"(https?://2e\.aonprd\.com[^\s]+)", prompt, flags=re.IGNORECASE
+            thread = await discord_handling.send_response(
+                response, message, thread, run.thread_name
             )
-            for new_url in new_urls:
-                await self.content_store.fetch_content(new_url)
-
-            for _, content in self.content_store.contents.items():
-                if content.summary is None:
-                    content.summary = await model_querying.generate_url_summary(
-                        content.url, content.name, model, token
-                    )
-
-            response = await model_querying.query_text_model(
-                token,
-                prompt,
-                formatted_query + self.content_store.to_openai(),
-                model=model,
-                user_names=user_names,
+            response_text = "\n".join(response)
+            step_tokens = estimate_message_tokens(step_messages) + estimate_tokens(response_text)
+            budget_tokens += step_tokens
+            run.tokens_used += step_tokens
+            run.step += 1
+            run.thread_id = thread.id
+            await thread.send(
+                f"-# step {run.step}: ~{estimate_message_tokens(step_messages)} prompt tokens, "
+                f"~{estimate_tokens(response_text)} response tokens, {frontier.pages_fetched} pages fetched, "
+                f"fetch {fetched - started:.1f}s, model {finished - fetched:.1f}s"
             )
-            await discord_handling.send_response(response, message, thread, thread_name)
-            if "<<<DONE>>>" in "\n".join(response):
-                break
+
+            scratchpad.add(run.step, response_text)
+            if "<<<DONE>>>" in response_text:
+                run.status = "done"
+                await self._save_checkpoint(run)
+                return
+            await self._save_checkpoint(run)
+            new_urls = extract_aonprd_urls(response_text)
+
+        run.status = "done"
+        await self._save_checkpoint(run)
@@ -1,13 +1,54 @@
 from __future__ import annotations
 
+import asyncio
+
 import discord
 from redbot.core import commands
 
 from .base import ChatBase
 from .. import model_querying, discord_handling
+from ..tarot_index import TarotIndex, TarotCard
+
+GUIDE_TOKEN_BUDGET = 3000
+CARD_LISTING_PROMPT = (
+    "List every tarot card visible in the attached images, one per line, written as its full name (for example "
+    "`The Tower` or `Three of Cups`) followed by `reversed` if it is upside down. Reply with the list only."
+)
 
 
 class TarotCommands(ChatBase):
+    tarot_index: TarotIndex = None
+
+    async def cog_load(self):
+        await super().cog_load()
+        await self.load_tarot_index()
+
+    async def load_tarot_index(self):
+        loop = asyncio.get_running_loop()
+        self.tarot_index = await loop.run_in_executor(
+            None, TarotIndex.from_file, self.data_dir / "tarot_guide.txt"
+        )
+
+    async def detect_cards(
+        self, token: str, model: str, formatted_query: list[dict]
+    ) -> list[TarotCard]:
+        """
+        Ask the model which cards appear in the images of the query. Only used when the text names no cards.
+        """
+        images = [
+            part
+            for message in formatted_query
+            if isinstance(message.get("content"), list)
+            for part in message["content"]
+            if part.get("type") == "image_url"
+        ]
+        if not images:
+            return []
+        response = await model_querying.query_text_model(
+            token, CARD_LISTING_PROMPT, [{"role": "user", "content": images}], model=model
+        )
+        return self.tarot_index.find_cards("\n".join(response), tarot_context=True)
+
     @commands.command()
     async def tarot(self, ctx: commands.Context) -> None:
         """
@@ -43,12 +84,18 @@ class TarotCommands(ChatBase):
             await ctx.send("Something went wrong!")
             return
 
-        tarot_guide = (self.data_dir / "tarot_guide.txt").read_text()
-        lines_to_include = [(406, 799), (1444, 2904), (2906, 3299)]
-        split_guide = tarot_guide.split("\n")
-        passages = [
-            "\n".join(split_guide[start : end + 1]) for start, end in lines_to_include
-        ]
+        if self.tarot_index is None:
+            await self.load_tarot_index()
+        token = await self.get_openai_token()
+        model = (await self.settings.get(ctx.guild))["model"]
+        cards = self.tarot_index.find_cards(message.content)
+        if not cards:
+            cards = await self.detect_cards(token, model, formatted_query)
+        if cards:
+            passages = self.tarot_index.passages(cards, GUIDE_TOKEN_BUDGET)
+        else:
+            # nothing recognisable, fall back to the compact meanings of the greater arcana
+            passages = ["\n".join(card.meanings() for card in self.tarot_index.cards[:22])]
 
         prompt = (
             "You are Wrin Sivinxi.\n"
@@ -80,8 +127,6 @@ class TarotCommands(ChatBase):
             *formatted_query,
         ]
 
-        token = await self.get_openai_token()
-        model = await self.config.guild(ctx.guild).model()
         response = await model_querying.query_text_model(
             token, prompt, formatted_query, model=model, user_names=user_names
         )
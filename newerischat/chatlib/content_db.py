@@ -0,0 +1,317 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import pathlib
+import re
+import sqlite3
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from .url_content import CACHE, ContentStore, URLContent
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    hex TEXT NOT NULL,
+    name TEXT,
+    summary TEXT,
+    content BLOB,
+    markdown BLOB,
+    stats TEXT,
+    content_hash TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(
+    name, markdown, summary, content='', tokenize='porter unicode61'
+);
+"""
+
+
+def _compress(text: str | None) -> bytes | None:
+    if text is None:
+        return None
+    return zlib.compress(text.encode("utf-8"), 6)
+
+
+def _decompress(blob: bytes | None) -> str | None:
+    if blob is None:
+        return None
+    return zlib.decompress(blob).decode("utf-8")
+
+
+def _content_hash(markdown: str | None) -> str | None:
+    if markdown is None:
+        return None
+    return hashlib.sha256(markdown.encode("utf-8")).hexdigest()
+
+
+def _fts_query(query: str) -> str:
+    # quote every term so user text can never be parsed as FTS5 syntax
+    terms = re.findall(r"\w+", query.lower())
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+class SQLiteContentStore(ContentStore):
+    """
+    ContentStore backed by a single SQLite database. Page bodies are stored zlib-compressed and pages are loaded
+    lazily by URL; at most `max_loaded` of the most recently used ones are kept in `contents` and the chunk index.
+    Markdown, names and summaries are indexed with FTS5 for full-text search.
+    """
+
+    def __init__(self, cache_dir: pathlib.Path = CACHE, flush_delay: float = 2.0, max_loaded: int = 256):
+        super().__init__(cache_dir=cache_dir, flush_delay=flush_delay)
+        self.db_path = self.cache_dir / "pages.sqlite3"
+        self.max_loaded = max_loaded
+        # every database call goes through this single thread, so one connection is safe to share
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="content-db")
+        self._db: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(SCHEMA)
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(pages)")}
+            for column in ("stats", "content_hash", "etag", "last_modified"):
+                if column not in columns:
+                    self._db.execute(f"ALTER TABLE pages ADD COLUMN {column} TEXT")
+            self._db.execute("CREATE INDEX IF NOT EXISTS pages_content_hash ON pages(content_hash)")
+        return self._db
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def load(self):
+        """
+        Prepare the database. Nothing is read eagerly; legacy per-page JSON files found in the cache directory are
+        imported once and removed.
+        """
+        await self._run(self._import_legacy)
+
+    def _import_legacy(self):
+        self._connect()
+        for file in self.cache_dir.glob("*.json"):
+            try:
+                self._write_row(json.loads(file.read_text()))
+                file.unlink()
+            except Exception as e:
+                print(f"Failed to import {file}: {e}")
+
+    def _remember(self, content: URLContent):
+        # re-inserted so `contents` stays ordered from least to most recently used
+        self.contents.pop(content.url, None)
+        super()._remember(content)
+        self._evict(keep=content.url)
+
+    def _evict(self, keep: str | None = None):
+        for url in list(self.contents):
+            if len(self.contents) <= self.max_loaded:
+                break
+            # unwritten pages go once they are on disk; the one just remembered is about to be used or marked dirty
+            if url == keep or url in self._dirty or url in self._writing:
+                continue
+            content = self.contents.pop(url)
+            self.index.remove_page(url)
+            if self._by_hash.get(content.content_hash) == url:
+                del self._by_hash[content.content_hash]
+
+    def _write_row(self, data: dict):
+        db = self._connect()
+        with db:
+            old = db.execute(
+                "SELECT id, name, markdown, summary FROM pages WHERE url = ?",
+                (data["url"],),
+            ).fetchone()
+            if old is not None:
+                rowid, name, markdown, summary = old
+                db.execute(
+                    "INSERT INTO pages_fts(pages_fts, rowid, name, markdown, summary) "
+                    "VALUES('delete', ?, ?, ?, ?)",
+                    (rowid, name or "", _decompress(markdown) or "", summary or ""),
+                )
+            db.execute(
+                "INSERT INTO pages (url, hex, name, summary, content, markdown, stats, content_hash, etag, "
+                "last_modified, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(url) DO UPDATE SET hex=excluded.hex, name=excluded.name, "
+                "summary=excluded.summary, content=excluded.content, markdown=excluded.markdown, "
+                "stats=excluded.stats, content_hash=excluded.content_hash, etag=excluded.etag, "
+                "last_modified=excluded.last_modified, updated_at=excluded.updated_at",
+                (
+                    data["url"],
+                    data["hex"],
+                    data.get("name"),
+                    data.get("summary"),
+                    _compress(data.get("content")),
+                    _compress(data.get("markdown")),
+                    json.dumps(data.get("stats")),
+                    _content_hash(data.get("markdown")),
+                    data.get("etag"),
+                    data.get("last_modified"),
+                    time.time(),
+                ),
+            )
+            (rowid,) = db.execute(
+                "SELECT id FROM pages WHERE url = ?", (data["url"],)
+            ).fetchone()
+            db.execute(
+                "INSERT INTO pages_fts(rowid, name, markdown, summary) VALUES (?, ?, ?, ?)",
+                (
+                    rowid,
+                    data.get("name") or "",
+                    data.get("markdown") or "",
+                    data.get("summary") or "",
+                ),
+            )
+
+    def _read_row(self, url: str) -> dict | None:
+        row = (
+            self._connect()
+            .execute(
+                "SELECT url, hex, name, summary, content, markdown, stats, etag, last_modified "
+                "FROM pages WHERE url = ?",
+                (url,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        url, hex_, name, summary, content, markdown, stats, etag, last_modified = row
+        return {
+            "url": url,
+            "hex": hex_,
+            "name": name,
+            "summary": summary,
+            "content": _decompress(content),
+            "markdown": _decompress(markdown),
+            "stats": json.loads(stats) if stats else None,
+            "etag": etag,
+            "last_modified": last_modified,
+        }
+
+    def _all_urls(self) -> list[str]:
+        return [url for (url,) in self._connect().execute("SELECT url FROM pages ORDER BY url")]
+
+    def _url_for_hash(self, content_hash: str) -> str | None:
+        row = (
+            self._connect()
+            .execute("SELECT url FROM pages WHERE content_hash = ? LIMIT 1", (content_hash,))
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def _search_rows(self, query: str, limit: int) -> list[str]:
+        match = _fts_query(query)
+        if not match:
+            return []
+        rows = (
+            self._connect()
+            .execute(
+                "SELECT pages.url FROM pages_fts JOIN pages ON pages.id = pages_fts.rowid "
+                "WHERE pages_fts MATCH ? ORDER BY bm25(pages_fts) LIMIT ?",
+                (match, limit),
+            )
+            .fetchall()
+        )
+        return [url for (url,) in rows]
+
+    async def _persist(self, content: URLContent):
+        await self._run(self._write_row, await content.to_dict())
+
+    async def _find_duplicate(self, content: URLContent) -> URLContent | None:
+        duplicate = await super()._find_duplicate(content)
+        if duplicate is not None or content.content_hash is None:
+            return duplicate
+        url = await self._run(self._url_for_hash, content.content_hash)
+        if url is None or url == content.url:
+            return None
+        return await self.get(url)
+
+    async def save(self) -> bool:
+        written = await super().save()
+        self._evict()
+        return written
+
+    async def all_urls(self) -> list[str]:
+        # loaded pages that haven't been written yet aren't in the database
+        return sorted(set(await self._run(self._all_urls)) | set(self.contents))
+
+    async def read_page(self, url: str) -> dict | None:
+        if url in self.contents:
+            return await self.contents[url].to_dict()
+        return await self._run(self._read_row, url)
+
+    async def import_page(self, data: dict):
+        # written straight to the database so importing a large archive doesn't fill the working set
+        url = self.resolve(data["url"])
+        self.contents.pop(url, None)
+        self.index.remove_page(url)
+        await self._run(self._write_row, data)
+
+    async def get(self, url: str) -> URLContent | None:
+        """Return a stored page, reading it from the database on first access."""
+        url = self.resolve(url)
+        if url in self.contents:
+            content = self.contents.pop(url)
+            self.contents[url] = content
+            return content
+        data = await self._run(self._read_row, url)
+        if data is None:
+            return None
+        content = URLContent.from_json(data)
+        self._remember(content)
+        return content
+
+    async def search(self, query: str, limit: int = 10) -> list[URLContent]:
+        """Full-text search over stored markdown, page names and summaries, best matches first."""
+        urls = await self._run(self._search_rows, query, limit)
+        return [content for url in urls if (content := await self.get(url)) is not None]
+
+    async def refresh_content(self, url: str) -> bool:
+        """
+        Same as `ContentStore.refresh_content`, but a page that isn't loaded is revalidated and written straight from
+        its row, so mirroring the whole site doesn't pull every page through the working set.
+        """
+        url = self.resolve(url)
+        if url in self.contents:
+            return await super().refresh_content(url)
+        data = await self._run(self._read_row, url)
+        if data is None:
+            content = URLContent(url)
+            await content.fetch()
+            duplicate = self._by_hash.get(content.content_hash) or await self._run(
+                self._url_for_hash, content.content_hash
+            )
+            if duplicate is not None and duplicate != url:
+                self.aliases[url] = duplicate
+                return False
+            await self._run(self._write_row, await content.to_dict())
+            return True
+        content = URLContent.from_json(data)
+        validators = (content.etag, content.last_modified)
+        changed = await content.refresh()
+        if changed:
+            content.summary = None
+        if changed or (content.etag, content.last_modified) != validators:
+            await self._run(self._write_row, await content.to_dict())
+        return changed
+
+    async def fetch_content(self, url: str) -> URLContent:
+        content = await self.get(url)
+        if content is not None:
+            return content
+        return await super().fetch_content(url)
+
+    async def close(self):
+        await super().close()
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        self._executor.shutdown(wait=False)
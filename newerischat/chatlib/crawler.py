@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import asyncio
+import time
+import urllib.parse
+from collections import defaultdict
+
+from .downloads import DownloadError, canonicalize_url
+from .url_content import ContentStore, URLContent
+
+# requests per second and burst size per host; anything unlisted gets the default
+HOST_RATES: dict[str, tuple[float, int]] = {
+    "2e.aonprd.com": (1.0, 2),
+}
+DEFAULT_RATE = (2.0, 4)
+PER_HOST_CONCURRENCY = 2
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class HostLimiter:
+    """Per-host token buckets plus a per-host cap on in-flight requests. Share one across crawls."""
+
+    def __init__(self, rates: dict[str, tuple[float, int]] = None):
+        self.rates = HOST_RATES if rates is None else rates
+        self.buckets: dict[str, TokenBucket] = {}
+        self.semaphores: dict[str, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(PER_HOST_CONCURRENCY)
+        )
+
+    def bucket(self, host: str) -> TokenBucket:
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(*self.rates.get(host, DEFAULT_RATE))
+        return self.buckets[host]
+
+    async def run(self, url: str, coro_fn):
+        host = urllib.parse.urlsplit(url).hostname or ""
+        async with self.semaphores[host]:
+            await self.bucket(host).acquire()
+            return await coro_fn()
+
+
+class CrawlFrontier:
+    """
+    Fetches batches of URLs into a ContentStore for a single run. URLs are deduplicated across the whole run,
+    independent URLs are downloaded concurrently under the host limiter, and the run stops fetching new pages once
+    its page or byte budget is spent. Pages already in the store are free. Only URLs that are now stored stay in
+    `seen`; failed or skipped ones are dropped so they can be retried.
+    """
+
+    def __init__(
+        self,
+        store: ContentStore,
+        limiter: HostLimiter,
+        max_pages: int = 60,
+        max_bytes: int = 25_000_000,
+        concurrency: int = 6,
+    ):
+        self.store = store
+        self.limiter = limiter
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.seen: set[str] = set()
+        self.pages_fetched = 0
+        self.bytes_fetched = 0
+        self.failed: dict[str, str] = {}
+
+    @property
+    def exhausted(self) -> bool:
+        return self.pages_fetched >= self.max_pages or self.bytes_fetched >= self.max_bytes
+
+    async def _visit(self, url: str) -> URLContent | None:
+        cached = await self.store.get(url)
+        if cached is not None:
+            return cached
+        async with self.semaphore:
+            if self.exhausted:
+                self.seen.discard(url)  # never fetched, so a later crawl may try it again
+                return None
+            # reserve the slot before awaiting so concurrent visits can't overshoot the budget
+            self.pages_fetched += 1
+            content = None
+            try:
+                content = await self.limiter.run(url, lambda: self.store.fetch_content(url))
+            except DownloadError as e:
+                self.failed[url] = str(e)
+                return None
+            finally:
+                if content is None:
+                    self.seen.discard(url)
+            self.bytes_fetched += (content.stats or {}).get("html_bytes", 0)
+            return content
+
+    async def crawl(self, urls: list[str]) -> list[URLContent]:
+        """Fetch every URL not seen earlier in this run and return the pages that are now available."""
+        new_urls = []
+        for url in urls:
+            url = canonicalize_url(url)
+            if url not in self.seen:
+                self.seen.add(url)
+                new_urls.append(url)
+        results = await asyncio.gather(*[self._visit(url) for url in new_urls])
+        return [content for content in results if content is not None]
@@ -1,14 +1,17 @@
 from __future__ import annotations
 
+import asyncio
 import re
 import datetime as dt
 import json
 import io
 from typing import List, Tuple
 import string
+from dataclasses import dataclass
 
 import discord
 
+from . import downloads
 from .url_content import URLContent
 
 
@@ -167,9 +170,9 @@ async def extract_history(
     return history, users_involved
 
 
-async def fetch_url(url: str) -> URLContent:
+async def fetch_url(url: str, max_bytes: int = downloads.MAX_DOWNLOAD_BYTES) -> URLContent:
     url_content = URLContent(url)
-    await url_content.fetch()
+    await url_content.fetch(max_bytes=max_bytes)
     return url_content
 
 
@@ -184,6 +187,9 @@ async def extract_message(message: str, keep_all_words: bool, skip_command_word:
             try:
                 urlc = await fetch_url(url)
                 page_contents.append(urlc)
+            except downloads.DownloadError as e:
+                print(f"Refused {url}: {e}")
+                continue
             except Exception as e:
                 print(f"Error fetching {url}")
                 continue
@@ -224,6 +230,73 @@ async def send_response(
         await channel_or_thread.send(file=discord.File(response, filename=filename))
     return channel_or_thread
 
+# Discord only bulk-deletes messages younger than 14 days, keep a margin so a batch doesn't age out mid-request
+BULK_DELETE_MAX_AGE = dt.timedelta(days=14) - dt.timedelta(minutes=5)
+BULK_DELETE_BATCH = 100
+# older messages go through the much stricter single-delete bucket, so space them out
+SINGLE_DELETE_INTERVAL = 1.2
+
+
+@dataclass
+class DeletionReport:
+    bulk: int = 0
+    single: int = 0
+    missing: int = 0
+    failed: int = 0
+
+    @property
+    def removed(self) -> int:
+        return self.bulk + self.single
+
+    def __str__(self) -> str:
+        summary = f"Removed {self.removed} message{'s' if self.removed != 1 else ''}"
+        details = []
+        if self.bulk:
+            details.append(f"{self.bulk} in bulk")
+        if self.single:
+            details.append(f"{self.single} one by one")
+        if self.missing:
+            details.append(f"{self.missing} already gone")
+        if self.failed:
+            details.append(f"{self.failed} could not be deleted")
+        return summary + (f" ({', '.join(details)})" if details else "") + "."
+
+
+async def delete_messages(
+    channel: discord.TextChannel | discord.Thread, messages: List[discord.Message]
+) -> DeletionReport:
+    """
+    Delete `messages` from `channel` with as few API calls as possible. Messages under 14 days old are bulk-deleted
+    in batches of 100, older ones (or any batch the bulk endpoint refuses) are queued and deleted one at a time at a
+    pace that stays inside the single-delete rate limit.
+    """
+    report = DeletionReport()
+    cutoff = discord.utils.utcnow() - BULK_DELETE_MAX_AGE
+    recent = [m for m in messages if m.created_at > cutoff]
+    queue = [m for m in messages if m.created_at <= cutoff]
+
+    for start in range(0, len(recent), BULK_DELETE_BATCH):
+        batch = recent[start : start + BULK_DELETE_BATCH]
+        try:
+            await channel.delete_messages(batch)
+            report.bulk += len(batch)
+        except discord.HTTPException as e:
+            print(f"Bulk delete failed, falling back to single deletes: {e}")
+            queue.extend(batch)
+
+    for i, queued in enumerate(queue):
+        if i:
+            await asyncio.sleep(SINGLE_DELETE_INTERVAL)
+        try:
+            await queued.delete()
+            report.single += 1
+        except discord.NotFound:
+            report.missing += 1
+        except discord.HTTPException as e:
+            print(f"Could not delete message {queued.id}: {e}")
+            report.failed += 1
+    return report
+
 
 def extract_system_messages_from_message(message: str) -> Tuple[str, List[str]]:
     # extract the system messages
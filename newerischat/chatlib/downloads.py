@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import json
+import time
+import urllib.parse
+from dataclasses import dataclass
+
+import aiohttp
+
+from . import html_pipeline
+from .tokens import estimate_tokens
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+MAX_DOWNLOAD_BYTES = 3_000_000
+SNIFF_BYTES = 4096
+TIMEOUT = aiohttp.ClientTimeout(total=30, sock_read=10)
+
+HTML, TEXT, JSON, PDF, BINARY = "html", "text", "json", "pdf", "binary"
+# kinds that are still useful when cut off at the byte limit
+TRUNCATABLE = {HTML, TEXT}
+
+TRACKING_PARAMETERS = {"fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "igshid", "ref", "ref_src"}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# seconds a failure is remembered for, keyed by what went wrong
+NEGATIVE_TTL_CLIENT_ERROR = 600
+NEGATIVE_TTL_SERVER_ERROR = 120
+NEGATIVE_TTL_TIMEOUT = 60
+
+
+class DownloadError(Exception):
+    """Raised when a resource is refused, unreachable or answers with an error status."""
+
+    def __init__(self, message: str, status: int | None = None):
+        super().__init__(message)
+        self.status = status
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Normalise a URL so trivially different spellings of the same page compare equal: lowercase scheme and host,
+    default ports and fragments dropped, tracking parameters removed and the remaining query sorted.
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = [
+        (key, value)
+        for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMETERS
+    ]
+    query.sort()
+    path = parts.path or "/"
+    return urllib.parse.urlunsplit((scheme, host, path, urllib.parse.urlencode(query), ""))
+
+
+class NegativeCache:
+    """Remembers recently failed URLs so they are not refetched until their TTL runs out."""
+
+    def __init__(self):
+        self.failures: dict[str, tuple[float, str]] = {}
+
+    def check(self, url: str):
+        failure = self.failures.get(url)
+        if failure is None:
+            return
+        expires_at, reason = failure
+        if time.monotonic() >= expires_at:
+            del self.failures[url]
+            return
+        raise DownloadError(f"{url} recently failed ({reason}), not retrying yet")
+
+    def record(self, url: str, reason: str, ttl: float):
+        self.failures[url] = (time.monotonic() + ttl, reason)
+        if len(self.failures) > 1024:
+            now = time.monotonic()
+            self.failures = {u: f for u, f in self.failures.items() if f[0] > now}
+
+
+negative_cache = NegativeCache()
+
+
+@dataclass
+class Download:
+    url: str
+    status: int
+    kind: str
+    body: bytes
+    charset: str
+    truncated: bool = False
+    etag: str | None = None
+    last_modified: str | None = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.status == 304
+
+    @property
+    def text(self) -> str:
+        return self.body.decode(self.charset or "utf-8", errors="replace")
+
+
+def sniff(content_type: str, head: bytes) -> str:
+    """Classify a response from its Content-Type header and its first bytes, trusting magic bytes over headers."""
+    content_type = (content_type or "").lower()
+    stripped = head.lstrip()[:512].lower()
+    if head.startswith(b"%PDF-"):
+        return PDF
+    if stripped.startswith((b"<!doctype html", b"<html")) or b"<head" in stripped or b"<body" in stripped:
+        return HTML
+    if b"\x00" in head:
+        return BINARY
+    if "pdf" in content_type:
+        return PDF
+    if "html" in content_type or "xml" in content_type:
+        return HTML
+    if "json" in content_type or (stripped[:1] in (b"{", b"[") and "text/html" not in content_type):
+        return JSON
+    if content_type.startswith("text/") or not content_type:
+        return TEXT
+    return BINARY
+
+
+async def download(
+    session: aiohttp.ClientSession,
+    url: str,
+    max_bytes: int = MAX_DOWNLOAD_BYTES,
+    etag: str | None = None,
+    last_modified: str | None = None,
+) -> Download:
+    """
+    Stream `url` into memory, reading at most `max_bytes`. Binary resources and oversized non-text documents are
+    refused as soon as the headers or first bytes give them away; oversized HTML and text are truncated.
+
+    Passing the `etag` / `last_modified` validators of a previous download makes the request conditional, in which
+    case an unchanged resource comes back as an empty download with `not_modified` set.
+    """
+    negative_cache.check(url)
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    try:
+        return await _download(session, url, max_bytes, headers)
+    except DownloadError as e:
+        if e.status is not None:
+            ttl = NEGATIVE_TTL_SERVER_ERROR if e.status >= 500 else NEGATIVE_TTL_CLIENT_ERROR
+            negative_cache.record(url, f"HTTP {e.status}", ttl)
+        raise
+    except asyncio.TimeoutError:
+        negative_cache.record(url, "timeout", NEGATIVE_TTL_TIMEOUT)
+        raise DownloadError(f"Timed out fetching {url}")
+    except aiohttp.ClientError as e:
+        negative_cache.record(url, type(e).__name__, NEGATIVE_TTL_SERVER_ERROR)
+        raise DownloadError(f"Could not fetch {url}: {e}")
+
+
+async def _download(
+    session: aiohttp.ClientSession, url: str, max_bytes: int, headers: dict
+) -> Download:
+    resp: aiohttp.ClientResponse
+    async with session.get(url, headers=headers) as resp:
+        etag = resp.headers.get("ETag")
+        last_modified = resp.headers.get("Last-Modified")
+        if resp.status == 304:
+            return Download(url, resp.status, BINARY, b"", resp.charset, etag=etag, last_modified=last_modified)
+        if resp.status != 200:
+            raise DownloadError(f"{url} returned HTTP {resp.status}", status=resp.status)
+
+        head = await resp.content.read(SNIFF_BYTES)
+        kind = sniff(resp.headers.get("Content-Type", ""), head)
+        if kind == BINARY:
+            raise DownloadError(f"Unsupported content at {url}")
+        if kind == PDF and pypdf is None:
+            raise DownloadError(f"No PDF extractor available for {url}")
+
+        declared_length = resp.content_length or 0
+        if declared_length > max_bytes and kind not in TRUNCATABLE:
+            raise DownloadError(f"{url} is {declared_length} bytes, limit is {max_bytes}")
+
+        body = bytearray(head)
+        truncated = False
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            body += chunk
+            if len(body) > max_bytes:
+                if kind not in TRUNCATABLE:
+                    raise DownloadError(f"{url} exceeds the {max_bytes} byte limit")
+                del body[max_bytes:]
+                truncated = True
+                break
+        return Download(
+            url, resp.status, kind, bytes(body), resp.charset, truncated, etag, last_modified
+        )
+
+
+def pdf_to_markdown(data: bytes) -> html_pipeline.ConvertedPage:
+    reader = pypdf.PdfReader(io.BytesIO(data))
+    title = None
+    if reader.metadata is not None:
+        title = reader.metadata.title
+    pages = [page.extract_text() or "" for page in reader.pages]
+    markdown = html_pipeline.collapse_whitespace("\n\n".join(pages))
+    return html_pipeline.ConvertedPage(title=title, markdown=markdown, stats={})
+
+
+def json_to_markdown(text: str) -> html_pipeline.ConvertedPage:
+    try:
+        text = json.dumps(json.loads(text), indent=1, ensure_ascii=False)
+    except ValueError:
+        pass  # truncated or malformed, show it as is
+    return html_pipeline.ConvertedPage(title=None, markdown=f"```json\n{text}\n```", stats={})
+
+
+async def extract(download: Download) -> html_pipeline.ConvertedPage:
+    """Route a download to the extractor for its kind. HTML and PDF parsing run in the worker pool."""
+    if download.kind == HTML:
+        page = await html_pipeline.convert(download.text)
+    elif download.kind == PDF:
+        page = await html_pipeline.run_in_pool(pdf_to_markdown, download.body)
+    elif download.kind == JSON:
+        page = json_to_markdown(download.text)
+    else:
+        page = html_pipeline.ConvertedPage(
+            title=None, markdown=html_pipeline.collapse_whitespace(download.text), stats={}
+        )
+
+    page.stats.setdefault("html_bytes", len(download.body))
+    page.stats.setdefault("markdown_bytes", len(page.markdown.encode("utf-8")))
+    page.stats.setdefault("estimated_tokens_saved", 0)
+    page.stats["kind"] = download.kind
+    page.stats["truncated"] = download.truncated
+    page.stats["estimated_tokens"] = estimate_tokens(page.markdown)
+    return page
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import pathlib
+import re
+import site
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+
+import bs4
+from markdownify import MarkdownConverter
+
+from .tokens import estimate_tokens
+
+try:
+    import lxml  # noqa: F401
+
+    PARSER = "lxml"
+except ImportError:
+    PARSER = "html.parser"
+
+# tags that never carry readable content
+STRIP_TAGS = ["script", "style", "noscript", "template", "svg", "iframe"]
+# page chrome that surrounds the content we care about
+BOILERPLATE_TAGS = ["nav", "header", "footer", "aside", "form", "button", "select"]
+BOILERPLATE_PATTERN = re.compile(
+    r"nav|menu|footer|header|sidebar|breadcrumb|cookie|banner|social|share|advert|promo|related|comment|skip-link",
+    re.IGNORECASE,
+)
+MAIN_CONTENT_SELECTORS = ["main", "article", "[role=main]", "#main", "#content", "#main-content"]
+CANDIDATE_TAGS = ["div", "section", "td", "article"]
+# a block where most of the text is link text, with at least this many links, is treated as a link farm
+LINK_FARM_DENSITY = 0.6
+LINK_FARM_MIN_LINKS = 8
+
+_pool: ProcessPoolExecutor | None = None
+# workers import this module by name, so they need the directory the cog was loaded from, which Red doesn't put on
+# sys.path
+IMPORT_ROOT = str(pathlib.Path(__file__).resolve().parents[__name__.count(".")])
+
+
+@dataclass
+class ConvertedPage:
+    title: str | None
+    markdown: str
+    stats: dict
+
+
+def _text_length(tag: bs4.Tag) -> int:
+    return len(tag.get_text(" ", strip=True))
+
+
+def _link_density(tag: bs4.Tag) -> tuple[float, int]:
+    text_length = _text_length(tag)
+    links = tag.find_all("a")
+    if text_length == 0:
+        return (1.0 if links else 0.0), len(links)
+    link_length = sum(_text_length(a) for a in links)
+    return link_length / text_length, len(links)
+
+
+def _is_boilerplate(tag: bs4.Tag) -> bool:
+    if tag.attrs is None or tag.name in ("html", "body"):
+        return False
+    if tag.get("role") in ("navigation", "banner", "contentinfo", "complementary"):
+        return True
+    identifiers = " ".join([tag.get("id") or "", *(tag.get("class") or [])])
+    return bool(identifiers) and bool(BOILERPLATE_PATTERN.search(identifiers))
+
+
+def _best_candidate(soup: bs4.BeautifulSoup) -> bs4.Tag:
+    """
+    Readability-style fallback: every paragraph credits its text to its parent block and half of it to the
+    grandparent, and the block with the highest link-adjusted score wins.
+    """
+    scores: dict[int, tuple[bs4.Tag, float]] = {}
+    for paragraph in soup.find_all(["p", "pre", "li", "h2", "h3"]):
+        length = _text_length(paragraph)
+        if length < 25:
+            continue
+        for tag, weight in ((paragraph.parent, 1.0), (getattr(paragraph.parent, "parent", None), 0.5)):
+            if tag is None or tag.name not in CANDIDATE_TAGS:
+                continue
+            _, score = scores.get(id(tag), (tag, 0.0))
+            scores[id(tag)] = (tag, score + length * weight)
+
+    best, best_score = None, 0.0
+    for tag, score in scores.values():
+        density, _ = _link_density(tag)
+        score *= 1 - density
+        if score > best_score:
+            best, best_score = tag, score
+    return best or soup.body or soup
+
+
+def extract_main_content(soup: bs4.BeautifulSoup) -> bs4.Tag:
+    for tag in soup(STRIP_TAGS):
+        tag.decompose()
+
+    root = None
+    for selector in MAIN_CONTENT_SELECTORS:
+        root = soup.select_one(selector)
+        if root is not None:
+            break
+
+    scope = root or soup
+    page_length = _text_length(scope) or 1
+    for tag in [*scope(BOILERPLATE_TAGS), *scope.find_all(_is_boilerplate)]:
+        # a wrapper holding most of the page is layout, not chrome, whatever its class says
+        if tag.decomposed or _text_length(tag) > page_length / 2:
+            continue
+        tag.decompose()
+
+    if root is None:
+        root = _best_candidate(soup)
+
+    root_length = _text_length(root) or 1
+    for tag in root.find_all(["ul", "ol", "table", "div", "section", "p"]):
+        if tag.decomposed:
+            continue
+        density, n_links = _link_density(tag)
+        # index pages are mostly links by design, so never drop the bulk of the content
+        is_link_farm = n_links >= LINK_FARM_MIN_LINKS and density >= LINK_FARM_DENSITY
+        if is_link_farm and _text_length(tag) <= root_length / 2:
+            tag.decompose()
+    return root
+
+
+def collapse_whitespace(markdown: str) -> str:
+    markdown = re.sub(r"[ \t]+\n", "\n", markdown)
+    markdown = re.sub(r"(?<=\S)[ \t]{2,}", " ", markdown)
+    markdown = re.sub(r"\n{3,}", "\n\n", markdown)
+    return markdown.strip()
+
+
+def html_to_markdown(html: str) -> ConvertedPage:
+    """
+    Parse `html` once and produce the page title and the markdown of its main content, with navigation, footers and
+    link farms removed. This is CPU bound and is meant to be run through `convert` rather than on the event loop.
+    """
+    soup = bs4.BeautifulSoup(html, PARSER)
+    title = None
+    if soup.title is not None and soup.title.string:
+        title = soup.title.string.strip()
+
+    full_text = soup.get_text(" ", strip=True)
+    root = extract_main_content(soup)
+    markdown = collapse_whitespace(MarkdownConverter(heading_style="ATX").convert_soup(root))
+
+    stats = {
+        "html_bytes": len(html.encode("utf-8")),
+        "full_text_bytes": len(full_text.encode("utf-8")),
+        "markdown_bytes": len(markdown.encode("utf-8")),
+        "estimated_tokens_saved": max(0, estimate_tokens(full_text) - estimate_tokens(markdown)),
+    }
+    return ConvertedPage(title=title, markdown=markdown, stats=stats)
+
+
+def start_pool() -> ProcessPoolExecutor:
+    """
+    Start the worker pool. Workers come from a forkserver rather than being forked from the bot, which by then has
+    an event loop and several threads running that a forked child would inherit in whatever state they were in.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=max(1, min(4, (os.cpu_count() or 2) - 1)),
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=site.addsitedir,
+            initargs=(IMPORT_ROOT,),
+        )
+    return _pool
+
+
+def get_pool() -> ProcessPoolExecutor:
+    # the cog starts the pool when it loads, this only covers callers outside of it
+    return start_pool()
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def run_in_pool(fn, *args):
+    """
+    Run `fn` in the worker pool. If the pool has broken, because a worker died or couldn't start, it is replaced for
+    later calls and this one runs in a thread instead.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_pool(), fn, *args)
+    except BrokenProcessPool as e:
+        print(f"Worker pool broke, restarting it: {e}")
+        shutdown_pool()
+        return await loop.run_in_executor(None, fn, *args)
+
+
+async def convert(html: str) -> ConvertedPage:
+    """Convert a page in the worker pool so large documents don't stall the bot."""
+    return await run_in_pool(html_to_markdown, html)
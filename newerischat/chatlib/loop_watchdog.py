@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import asyncio
+import statistics
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass
+
+
+@dataclass
+class Stall:
+    started: float  # wall clock, for display
+    duration: float
+    stack: str
+
+
+class LoopWatchdog:
+    """
+    Samples event loop lag by timing a short periodic sleep, and runs a helper thread that notices when the loop has
+    stopped ticking for longer than `threshold` seconds. While the loop is stuck the thread grabs the loop thread's
+    current stack, which points straight at the blocking call; the stall's duration is filled in once it recovers.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25, max_samples: int = 6000, max_stalls: int = 20):
+        self.interval = interval
+        self.threshold = threshold
+        self.samples: deque[float] = deque(maxlen=max_samples)
+        self.stalls: deque[Stall] = deque(maxlen=max_stalls)
+        self.started_at: float | None = None
+        self._heartbeat = time.monotonic()
+        self._loop_thread: int | None = None
+        self._task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._current: Stall | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self.started_at = time.time()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._sample())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        self._stop.set()
+
+    def reset(self):
+        self.samples.clear()
+        self.stalls.clear()
+        self.started_at = time.time()
+
+    async def _sample(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            self.samples.append(lag)
+            self._heartbeat = time.monotonic()
+            if self._current is not None and lag > self._current.duration:
+                self._current.duration = lag
+            self._current = None
+
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 2):
+            stalled_for = time.monotonic() - self._heartbeat - self.interval
+            if stalled_for < self.threshold or self._current is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stall = Stall(time.time() - stalled_for, stalled_for, "".join(traceback.format_stack(frame)))
+            self._current = stall
+            self.stalls.append(stall)
+
+    def percentiles(self) -> dict[str, float]:
+        samples = list(self.samples)
+        if len(samples) < 2:
+            return {"p50": 0.0, "p99": 0.0, "max": max(samples, default=0.0)}
+        quantiles = statistics.quantiles(samples, n=100, method="inclusive")
+        return {"p50": quantiles[49], "p99": quantiles[98], "max": max(samples)}
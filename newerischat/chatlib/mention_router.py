@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+import discord
+from redbot.core import Config, checks, commands
+from redbot.core.bot import Red
+
+# every chat cog ships its own copy of this module, so the router is found through the bot rather than by class
+ROUTER_ATTRIBUTE = "chat_mention_router"
+
+
+def mentions_bot(message: discord.Message, bot_id: int) -> bool:
+    """
+    Cheap pre-filter run on every message the bot sees. Only looks at the message itself, no context, config or
+    network, so the vast majority of messages are dropped before any real work happens.
+    """
+    if message.author.bot:
+        return False
+    # raw_mentions runs a regex over the content, skip it when there can't be a mention at all
+    return "<@" in message.content and bot_id in message.raw_mentions
+
+
+@dataclass
+class Backend:
+    name: str
+    handler: Callable[[discord.Message], Awaitable[None]]
+    is_banned: Callable[[discord.Message], bool] | None = None
+
+
+class MentionRouter:
+    """
+    The one `on_message` listener shared by every loaded chat cog. Mention detection and ban checks happen once per
+    message, then the message goes to exactly one backend: the one routed to its channel, its thread's parent
+    channel or its guild, falling back to the first backend registered.
+    """
+
+    def __init__(self, bot: Red):
+        self.bot = bot
+        self.backends: dict[str, Backend] = {}
+        self.config = Config.get_conf(
+            None, identifier=23458972349810010102367456567347810102, cog_name="ChatMentionRouter"
+        )
+        self.config.register_global(routes={})
+        self.routes: dict[str, str] | None = None
+        self._bot_id: int | None = None
+        bot.add_listener(self.on_message, "on_message")
+        # the command belongs to the router, not to any one cog, so every chat cog can be loaded alongside the others
+        self.command = self._route_command()
+        if bot.get_command(self.command.name) is None:
+            bot.add_command(self.command)
+
+    def _route_command(self) -> commands.Command:
+        @commands.command(name="chatroute")
+        @checks.is_owner()
+        async def chatroute(ctx: commands.Context, backend: str = None, scope: str = "channel"):
+            """
+            Chooses which loaded chat cog answers mentions when more than one is loaded.
+            Usage:
+            [p]chatroute
+            [p]chatroute <backend or none> [channel or guild]
+            Example:
+            [p]chatroute newerischat guild
+            Without arguments the bot lists the loaded backends and which one answers mentions here.
+            """
+            await ctx.send(await describe_or_set_route(self, ctx, backend, scope))
+
+        return chatroute
+
+    def register(self, backend: Backend):
+        # registering under an existing name replaces it, so reloading a cog never doubles up its replies
+        self.backends[backend.name] = backend
+
+    def unregister(self, name: str):
+        self.backends.pop(name, None)
+        if not self.backends:
+            self.bot.remove_listener(self.on_message, "on_message")
+            if self.bot.get_command(self.command.name) is self.command:
+                self.bot.remove_command(self.command.name)
+            if getattr(self.bot, ROUTER_ATTRIBUTE, None) is self:
+                delattr(self.bot, ROUTER_ATTRIBUTE)
+
+    async def get_routes(self) -> dict[str, str]:
+        if self.routes is None:
+            self.routes = await self.config.routes()
+        return self.routes
+
+    async def set_route(self, scope_id: int, name: str | None):
+        """Route mentions in a channel or guild to the backend `name`, or clear the route if `name` is None."""
+        async with self.config.routes() as routes:
+            if name is None:
+                routes.pop(str(scope_id), None)
+            else:
+                routes[str(scope_id)] = name
+        self.routes = None
+
+    async def backend_for(self, message: discord.Message) -> Backend | None:
+        routes = await self.get_routes()
+        scopes = [
+            message.channel.id,
+            getattr(message.channel, "parent_id", None),
+            message.guild.id if message.guild else None,
+        ]
+        for scope in scopes:
+            name = routes.get(str(scope))
+            if name in self.backends:
+                return self.backends[name]
+        return next(iter(self.backends.values()), None)
+
+    async def on_message(self, message: discord.Message):
+        if self._bot_id is None:
+            if self.bot.user is None:  # not logged in yet
+                return
+            self._bot_id = self.bot.user.id
+        if not mentions_bot(message, self._bot_id):
+            return
+        if any(backend.is_banned is not None and backend.is_banned(message) for backend in self.backends.values()):
+            return
+        backend = await self.backend_for(message)
+        if backend is not None:
+            await backend.handler(message)
+
+
+def get_router(bot: Red) -> MentionRouter:
+    """The router shared by every chat cog on `bot`, created by whichever cog asks first."""
+    router = getattr(bot, ROUTER_ATTRIBUTE, None)
+    if router is None:
+        router = MentionRouter(bot)
+        setattr(bot, ROUTER_ATTRIBUTE, router)
+    return router
+
+
+async def describe_or_set_route(router: MentionRouter, ctx, backend: str | None, scope: str) -> str:
+    """
+    Body of the `chatroute` command. Without a backend it describes where mentions here would go, otherwise
+    it routes the channel or guild to `backend` (`none` clears the route).
+    """
+    if backend is None:
+        chosen = await router.backend_for(ctx.message)
+        return (
+            f"Loaded chat backends: {', '.join(f'`{name}`' for name in router.backends)}.\n"
+            f"Mentions here go to `{chosen.name if chosen else 'nothing'}`."
+        )
+    if scope.lower() in ("guild", "server", "g"):
+        if ctx.guild is None:
+            return "Guild routes can only be set in a guild."
+        scope_id, scope_name = ctx.guild.id, "this guild"
+    else:
+        scope_id, scope_name = ctx.channel.id, "this channel"
+    if backend.lower() == "none":
+        await router.set_route(scope_id, None)
+        return f"Cleared the route for {scope_name}."
+    if backend not in router.backends:
+        return f"`{backend}` is not loaded. Loaded backends: {', '.join(router.backends)}."
+    await router.set_route(scope_id, backend)
+    return f"Mentions in {scope_name} now go to `{backend}`."
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import asyncio
+import datetime as dt
+import json
+import pathlib
+from collections import OrderedDict, deque
+from dataclasses import astuple, dataclass
+
+from .url_content import atomic_write
+
+
+@dataclass
+class LoggedMessage:
+    content: str
+    timestamp: float
+    latency: float = 0.0
+    prompt_tokens: int = 0
+    response_tokens: int = 0
+    model: str | None = None
+
+    def format(self) -> str:
+        when = dt.datetime.fromtimestamp(self.timestamp).strftime("%Y-%m-%d %H:%M:%S")
+        return (
+            f"`{when}` {self.latency:.1f}s, ~{self.prompt_tokens} -> {self.response_tokens} tokens, "
+            f"{self.model}\n> {self.content}"
+        )
+
+
+class MessageLog:
+    """
+    Bounded log of the messages sent to the model, per channel. Each channel keeps its last `per_channel` entries,
+    and once the log as a whole holds more than `max_entries` entries or `max_channels` channels the least recently
+    active channels are dropped. Changes are written to `path` in the background, coalesced like page flushes.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        per_channel: int = 20,
+        max_entries: int = 2000,
+        max_channels: int = 200,
+        flush_delay: float = 5.0,
+    ):
+        self.path = path
+        self.per_channel = per_channel
+        self.max_entries = max_entries
+        self.max_channels = max_channels
+        self.flush_delay = flush_delay
+        self.channels: OrderedDict[int, deque[LoggedMessage]] = OrderedDict()
+        self.total = 0
+        self._flush_task: asyncio.Task | None = None
+
+    def __contains__(self, channel_id: int) -> bool:
+        return bool(self.channels.get(channel_id))
+
+    def __getitem__(self, channel_id: int) -> list[LoggedMessage]:
+        return list(self.channels.get(channel_id, ()))
+
+    def add(self, channel_id: int, entry: LoggedMessage):
+        entries = self.channels.get(channel_id)
+        if entries is None:
+            entries = self.channels[channel_id] = deque(maxlen=self.per_channel)
+        self.channels.move_to_end(channel_id)
+        if len(entries) == entries.maxlen:
+            self.total -= 1
+        entries.append(entry)
+        self.total += 1
+        self._evict()
+        self._schedule_flush()
+
+    def _evict(self):
+        # never evict the channel that was just written to
+        while len(self.channels) > 1 and (
+            self.total > self.max_entries or len(self.channels) > self.max_channels
+        ):
+            _, entries = self.channels.popitem(last=False)
+            self.total -= len(entries)
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_delay)
+        await self.save()
+
+    def _serialize(self) -> str:
+        # entries as bare tuples, oldest channel first so the LRU order survives a reload
+        data = [
+            [channel_id, [astuple(entry) for entry in entries]]
+            for channel_id, entries in self.channels.items()
+        ]
+        return json.dumps(data, separators=(",", ":"))
+
+    async def save(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, atomic_write, self.path, self._serialize())
+        except Exception as e:
+            print(f"Failed to persist logged messages: {e}")
+
+    async def close(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+            await self.save()
+
+    def load(self):
+        try:
+            data = json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"Could not read logged messages: {e}")
+            return
+        self.channels.clear()
+        self.total = 0
+        for channel_id, entries in data:
+            self.channels[channel_id] = deque(
+                (LoggedMessage(*entry) for entry in entries), maxlen=self.per_channel
+            )
+            self.total += len(self.channels[channel_id])
+        self._evict()
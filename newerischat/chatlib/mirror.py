@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import gzip
+import json
+import pathlib
+import re
+import time
+import urllib.parse
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from .crawler import HostLimiter
+from .downloads import DownloadError, canonicalize_url
+from .url_content import ContentStore
+
+ARCHIVE_VERSION = 1
+# pages encoded or decoded per trip to the executor while exporting or importing an archive
+ARCHIVE_BATCH = 100
+
+DEFAULT_MIRROR_URLS = [
+    "https://2e.aonprd.com/Backgrounds.aspx",
+    "https://2e.aonprd.com/Ancestries.aspx",
+    "https://2e.aonprd.com/Ancestries.aspx?Versatile=true",
+    "https://2e.aonprd.com/Classes.aspx",
+    "https://2e.aonprd.com/Archetypes.aspx",
+    "https://2e.aonprd.com/Skills.aspx",
+]
+# detail pages linked from the index pages that are worth mirroring too
+DEFAULT_FOLLOW_PATTERNS = [
+    r"/Backgrounds\.aspx\?ID=\d+$",
+    r"/Ancestries\.aspx\?ID=\d+$",
+    r"/Classes\.aspx\?ID=\d+$",
+    r"/Skills\.aspx\?ID=\d+$",
+]
+MARKDOWN_LINK = re.compile(r"\]\(\s*<?([^)\s>]+)")
+
+
+def extract_links(base_url: str, markdown: str) -> list[str]:
+    """Absolute, canonical URLs of every markdown link in a page."""
+    links = []
+    for href in MARKDOWN_LINK.findall(markdown or ""):
+        if href.startswith(("#", "mailto:", "javascript:")):
+            continue
+        links.append(canonicalize_url(urllib.parse.urljoin(base_url, href)))
+    return links
+
+
+@dataclass
+class MirrorProgress:
+    total: int = 0
+    done: int = 0
+    updated: int = 0
+    failed: dict[str, str] = field(default_factory=dict)
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def __str__(self):
+        return (
+            f"{self.done}/{self.total} pages checked, {self.updated} new or changed, "
+            f"{len(self.failed)} failed, {self.elapsed:.0f}s"
+        )
+
+
+async def mirror(
+    store: ContentStore,
+    limiter: HostLimiter,
+    urls: list[str],
+    follow_patterns: list[str] = None,
+    max_pages: int = 2000,
+    concurrency: int = 4,
+    on_progress: Callable[[MirrorProgress], Awaitable[None]] = None,
+) -> MirrorProgress:
+    """
+    Bring `urls`, and any detail pages they link to matching `follow_patterns`, into `store`. Pages already stored
+    are revalidated with conditional requests, so an unchanged page costs one 304 and no re-extraction.
+    """
+    patterns = [re.compile(p) for p in (DEFAULT_FOLLOW_PATTERNS if follow_patterns is None else follow_patterns)]
+    progress = MirrorProgress()
+    seen: set[str] = set()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def visit(url: str) -> list[str]:
+        async with semaphore:
+            try:
+                changed = await limiter.run(url, lambda: store.refresh_content(url))
+            except DownloadError as e:
+                progress.failed[url] = str(e)
+                changed = False
+            progress.done += 1
+            progress.updated += int(changed)
+            if on_progress is not None:
+                await on_progress(progress)
+        # read the stored row directly, mirroring thousands of pages shouldn't pull them all into the working set
+        page = await store.read_page(store.resolve(url))
+        if page is None:
+            return []
+        return [link for link in extract_links(page["url"], page["markdown"]) if any(p.search(link) for p in patterns)]
+
+    frontier = [canonicalize_url(url) for url in urls]
+    while frontier and len(seen) < max_pages:
+        batch = [url for url in dict.fromkeys(frontier) if url not in seen][: max_pages - len(seen)]
+        seen.update(batch)
+        progress.total = len(seen)
+        found = await asyncio.gather(*[visit(url) for url in batch])
+        frontier = [link for links in found for link in links if link not in seen]
+    return progress
+
+
+def _write_lines(f, records: list[dict]):
+    f.write("".join(json.dumps(record) + "\n" for record in records))
+
+
+def _read_lines(f, count: int) -> list[dict]:
+    records = []
+    while len(records) < count:
+        line = f.readline()
+        if not line:
+            break
+        if line.strip():
+            records.append(json.loads(line))
+    return records
+
+
+async def export_archive(store: ContentStore, path: pathlib.Path) -> int:
+    """
+    Write every stored page to a gzipped JSON-lines archive. The first line is a header, each following line is one
+    page as produced by `URLContent.to_dict`. Encoding, compression and file I/O run in the default executor, a batch
+    of pages at a time.
+    """
+    loop = asyncio.get_running_loop()
+    count = 0
+    await store.save()
+    f = await loop.run_in_executor(None, functools.partial(gzip.open, path, "wt", encoding="utf-8"))
+    try:
+        batch = [{"format": "content-store-archive", "version": ARCHIVE_VERSION}]
+        for url in await store.all_urls():
+            page = await store.read_page(url)
+            if page is None:
+                continue
+            batch.append(page)
+            count += 1
+            if len(batch) >= ARCHIVE_BATCH:
+                await loop.run_in_executor(None, _write_lines, f, batch)
+                batch = []
+        await loop.run_in_executor(None, _write_lines, f, batch)
+    finally:
+        await loop.run_in_executor(None, f.close)
+    return count
+
+
+async def import_archive(store: ContentStore, path: pathlib.Path) -> int:
+    loop = asyncio.get_running_loop()
+    count = 0
+    f = await loop.run_in_executor(None, functools.partial(gzip.open, path, "rt", encoding="utf-8"))
+    try:
+        header = (await loop.run_in_executor(None, _read_lines, f, 1) or [{}])[0]
+        if header.get("format") != "content-store-archive" or header.get("version", 0) > ARCHIVE_VERSION:
+            raise ValueError("Not a supported content store archive")
+        while batch := await loop.run_in_executor(None, _read_lines, f, ARCHIVE_BATCH):
+            for page in batch:
+                await store.import_page(page)
+                count += 1
+    finally:
+        await loop.run_in_executor(None, f.close)
+    await store.save()
+    return count
@@ -1,6 +1,9 @@
 from __future__ import annotations
 
+import contextlib
 import datetime as dt
+import heapq
+import itertools
 import re
 import asyncio
 from PIL import Image
@@ -14,6 +17,64 @@ import openai
 from redbot.core.utils import chat_formatting
 
 
+INTERACTIVE = 0
+BACKGROUND = 1
+
+
+class ModelScheduler:
+    """
+    Caps concurrent model calls. When slots are contended, interactive requests are always served before background
+    work, and background work may only ever hold `max_background` of the slots.
+    """
+
+    def __init__(self, max_concurrency: int = 6, max_background: int = 3):
+        self.max_concurrency = max_concurrency
+        self.max_background = max_background
+        self.running = {INTERACTIVE: 0, BACKGROUND: 0}
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    def _can_run(self, priority: int) -> bool:
+        if sum(self.running.values()) >= self.max_concurrency:
+            return False
+        return priority == INTERACTIVE or self.running[BACKGROUND] < self.max_background
+
+    def _wake(self):
+        while self._waiters:
+            priority, _, waiter = self._waiters[0]
+            if waiter.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._can_run(priority):
+                return
+            heapq.heappop(self._waiters)
+            self.running[priority] += 1
+            waiter.set_result(None)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: int = INTERACTIVE):
+        if not self._waiters and self._can_run(priority):
+            self.running[priority] += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._counter), waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self.running[priority] -= 1
+                    self._wake()
+                raise
+        try:
+            yield
+        finally:
+            self.running[priority] -= 1
+            self._wake()
+
+
+scheduler = ModelScheduler()
+
+
 async def query_text_model(
     token: str,
     prompt: str,
@@ -22,6 +83,7 @@ async def query_text_model(
     contextual_prompt: str = "",
     user_names=None,
     endpoint: str = "https://api.openai.com/v1/",
+    priority: int = INTERACTIVE,
 ) -> list[str] | io.BytesIO:
     if user_names is None:
         user_names = {}
@@ -55,12 +117,13 @@ async def query_text_model(
     if contextual_prompt != "":
         system_prefix[0]["content"].append({"type": "text", "text": contextual_prompt})
     kwargs = {"model": model, "temperature": 1, "max_tokens": 2000}
-    response = await construct_async_query(
-        system_prefix + formatted_query,
-        token,
-        endpoint,
-        **kwargs,
-    )
+    async with scheduler.slot(priority):
+        response = await construct_async_query(
+            system_prefix + formatted_query,
+            token,
+            endpoint,
+            **kwargs,
+        )
     return response
 
 
@@ -221,7 +284,12 @@ def pagify_chat_result(response: str) -> list[str]:
 
 
 async def generate_url_summary(
-    url_name: str, url_markdown: str, model: openai.Client, token: str
+    url_name: str,
+    url_markdown: str,
+    model: str,
+    token: str,
+    priority: int = BACKGROUND,
+    max_chars: int = 48_000,
 ) -> str:
     summary = "\n".join(
         await query_text_model(
@@ -236,12 +304,13 @@ async def generate_url_summary(
                     "content": [
                         {
                             "type": "text",
-                            "text": f"---\nFETCHED URL NAME: {url_name}\nCONTENTS:\n{url_markdown}\n---\n",
+                            "text": f"---\nFETCHED URL NAME: {url_name}\nCONTENTS:\n{(url_markdown or '')[:max_chars]}\n---\n",
                         }
                     ],
                 }
             ],
             model=model,
+            priority=priority,
         )
     )
     return summary
@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+from .tokens import estimate_tokens
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with "
+    "you your i we they he she them his her our their not but if then so".split()
+)
+
+
+def _stem(word: str) -> str:
+    # just enough folding for plurals like "feats" / "bombs" to meet their singular
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> list[str]:
+    return [_stem(w) for w in re.findall(r"\w+", text.lower()) if w not in STOPWORDS]
+
+
+@dataclass
+class Chunk:
+    url: str
+    position: int
+    text: str
+    tokens: int = field(init=False)
+
+    def __post_init__(self):
+        self.tokens = estimate_tokens(self.text)
+
+
+def chunk_markdown(url: str, markdown: str, max_tokens: int = 350) -> list[Chunk]:
+    """
+    Split markdown on headings and blank lines, packing consecutive paragraphs into chunks of at most `max_tokens`.
+    Paragraphs larger than the budget are hard-split on line boundaries.
+    """
+    max_chars = max_tokens * 4
+    blocks = []
+    for block in re.split(r"\n(?=#{1,6} )|\n{2,}", markdown or ""):
+        block = block.strip()
+        if not block:
+            continue
+        while len(block) > max_chars:
+            cut = block.rfind("\n", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            blocks.append(block[:cut])
+            block = block[cut:].strip()
+        if block:
+            blocks.append(block)
+
+    chunks, current = [], []
+    current_length = 0
+    for block in blocks:
+        starts_section = block.startswith("#")
+        if current and (current_length + len(block) > max_chars or starts_section):
+            chunks.append(Chunk(url, len(chunks), "\n\n".join(current)))
+            current, current_length = [], 0
+        current.append(block)
+        current_length += len(block) + 2
+    if current:
+        chunks.append(Chunk(url, len(chunks), "\n\n".join(current)))
+    return chunks
+
+
+class ChunkIndex:
+    """Okapi BM25 over page chunks. Pages can be re-indexed in place when their markdown changes."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.chunks: dict[tuple[str, int], Chunk] = {}
+        self.term_frequencies: dict[tuple[str, int], Counter] = {}
+        self.lengths: dict[tuple[str, int], int] = {}
+        self.postings: dict[str, set[tuple[str, int]]] = defaultdict(set)
+        self.pages: dict[str, list[tuple[str, int]]] = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def add_page(self, url: str, markdown: str):
+        self.remove_page(url)
+        keys = []
+        for chunk in chunk_markdown(url, markdown):
+            key = (url, chunk.position)
+            terms = Counter(tokenize(chunk.text))
+            self.chunks[key] = chunk
+            self.term_frequencies[key] = terms
+            self.lengths[key] = sum(terms.values())
+            self.total_length += self.lengths[key]
+            for term in terms:
+                self.postings[term].add(key)
+            keys.append(key)
+        self.pages[url] = keys
+
+    def remove_page(self, url: str):
+        for key in self.pages.pop(url, []):
+            for term in self.term_frequencies.pop(key):
+                self.postings[term].discard(key)
+                if not self.postings[term]:
+                    del self.postings[term]
+            self.total_length -= self.lengths.pop(key)
+            del self.chunks[key]
+
+    def search(self, query: str, k: int = 10) -> list[tuple[Chunk, float]]:
+        if not self.chunks:
+            return []
+        n_chunks = len(self.chunks)
+        average_length = self.total_length / n_chunks or 1
+        scores: dict[tuple[str, int], float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            matches = self.postings.get(term)
+            if not matches:
+                continue
+            idf = math.log(1 + (n_chunks - len(matches) + 0.5) / (len(matches) + 0.5))
+            for key in matches:
+                tf = self.term_frequencies[key][term]
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[key] / average_length)
+                scores[key] += idf * tf * (self.k1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.chunks[key], score) for key, score in ranked]
+
+    def retrieve(
+        self, query: str, token_budget: int, k: int = 20, exclude: set[tuple[str, int]] | None = None
+    ) -> list[Chunk]:
+        """
+        Best matching chunks for `query`, in rank order, until `token_budget` is used up. Chunks whose
+        `(url, position)` key is in `exclude` are skipped.
+        """
+        exclude = exclude or set()
+        selected, used = [], 0
+        for chunk, _ in self.search(query, k=k + len(exclude)):
+            if (chunk.url, chunk.position) in exclude or used + chunk.tokens > token_budget:
+                continue
+            selected.append(chunk)
+            used += chunk.tokens
+            if len(selected) >= k:
+                break
+        return selected
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import discord
+from redbot.core import Config
+from redbot.core.bot import Red
+
+# every chat cog ships its own copy of this module, so the caches are found through the bot rather than by class
+CACHES_ATTRIBUTE = "chat_settings_caches"
+
+
+class GuildSettingsCache:
+    """
+    In-memory snapshot of every guild's Config settings. A guild's snapshot is read from Config the first time it is
+    needed and served from memory afterwards; writes go through `set`, which updates Config and drops the snapshot
+    so the next read picks up the new value.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self._settings: dict[int, dict] = {}
+        # bumped on every invalidation so a read that raced a write doesn't cache the old values
+        self._generation: dict[int, int] = {}
+
+    async def get(self, guild: discord.Guild) -> dict:
+        settings = self._settings.get(guild.id)
+        if settings is None:
+            generation = self._generation.get(guild.id, 0)
+            settings = await self.config.guild(guild).all()
+            if self._generation.get(guild.id, 0) == generation:
+                self._settings[guild.id] = settings
+        return settings
+
+    async def set(self, guild: discord.Guild, key: str, value):
+        await self.config.guild(guild).set_raw(key, value=value)
+        self.invalidate(guild)
+
+    def invalidate(self, guild: discord.Guild | None = None):
+        """Forget one guild's snapshot, or every snapshot if no guild is given."""
+        if guild is None:
+            for guild_id in self._settings:
+                self._generation[guild_id] = self._generation.get(guild_id, 0) + 1
+            self._settings.clear()
+            return
+        self._settings.pop(guild.id, None)
+        self._generation[guild.id] = self._generation.get(guild.id, 0) + 1
+
+
+def get_settings_cache(bot: Red, config: Config) -> GuildSettingsCache:
+    """
+    The cache shared by every cog on `bot` storing its settings under the same Config identifier, created by whichever
+    cog asks first. A write made through one cog is then seen by all of them.
+    """
+    caches = getattr(bot, CACHES_ATTRIBUTE, None)
+    if caches is None:
+        caches = {}
+        setattr(bot, CACHES_ATTRIBUTE, caches)
+    key = (config.cog_name, config.unique_identifier)
+    cache = caches.get(key)
+    if cache is None:
+        cache = caches[key] = GuildSettingsCache(config)
+    elif cache.config is not config:
+        # the shared Config only knows the defaults of the cog that created it
+        cache.config.register_guild(**config.defaults.get(Config.GUILD, {}))
+        cache.invalidate()
+    return cache
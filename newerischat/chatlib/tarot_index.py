@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import pathlib
+import re
+from dataclasses import dataclass, field
+
+from .tokens import estimate_tokens
+
+NUMBER_WORDS = [
+    "ZERO", "ONE", "TWO", "THREE", "FOUR", "FIVE", "SIX", "SEVEN", "EIGHT", "NINE", "TEN",
+    "ELEVEN", "TWELVE", "THIRTEEN", "FOURTEEN", "FIFTEEN", "SIXTEEN", "SEVENTEEN", "EIGHTEEN",
+    "NINETEEN", "TWENTY", "TWENTY-ONE",
+]
+SUITS = ["WANDS", "CUPS", "SWORDS", "PENTACLES"]
+RANKS = ["KING", "QUEEN", "KNIGHT", "PAGE", "TEN", "NINE", "EIGHT", "SEVEN", "SIX", "FIVE", "FOUR", "THREE", "TWO", "ACE"]
+RANK_DIGITS = {"TEN": 10, "NINE": 9, "EIGHT": 8, "SEVEN": 7, "SIX": 6, "FIVE": 5, "FOUR": 4, "THREE": 3, "TWO": 2, "ACE": 1}
+SUIT_ALIASES = {
+    "WANDS": ["rods", "staves", "batons", "staffs"],
+    "CUPS": ["chalices"],
+    "SWORDS": [],
+    "PENTACLES": ["coins", "disks", "discs"],
+}
+MAJOR_ALIASES = {
+    "The Magician": ["Magus"],
+    "The Last Judgment": ["Judgment", "Judgement"],
+}
+
+MAJOR_HEADER = re.compile(rf"^({'|'.join(NUMBER_WORDS)})\. (.+)$")
+MINOR_HEADER = re.compile(rf"^(?:THE SUIT OF )?({'|'.join(SUITS)})\. ({'|'.join(RANKS)})\.$")
+MAJOR_MEANING = re.compile(r"^(?:(\d+)\.|_Zero\._)\s*_(.+?)\._--(.*)$", re.DOTALL)
+MINOR_MEANING = re.compile(r"^_(\w+)\._--(.*)$", re.DOTALL)
+DIVINATORY = re.compile(r"_Divinatory\s+Meanings_:\s*")
+REVERSED = re.compile(r"_Reversed_:\s*")
+# words suggesting a message is about cards, without one a bare "Sun" or "Death" is just a word
+TAROT_CONTEXT = re.compile(
+    r"\b(?:tarot|cards?|arcana|spread|reading|drew|draw|drawn|pulled|upright|reversed)\b", re.IGNORECASE
+)
+
+
+@dataclass(eq=False)
+class TarotCard:
+    name: str
+    section: str
+    aliases: list[str] = field(default_factory=list)
+    description: str = ""
+    upright: str = ""
+    reversed: str = ""
+    additional: str = ""
+
+    def meanings(self) -> str:
+        lines = [f"## {self.name} ({self.section})", f"Upright: {self.upright}"]
+        if self.reversed:
+            lines.append(f"Reversed: {self.reversed}")
+        if self.additional:
+            lines.append(f"Additional meanings: {self.additional}")
+        return "\n".join(lines)
+
+
+def _clean(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _split_reversed(text: str) -> tuple[str, str]:
+    parts = REVERSED.split(text, maxsplit=1)
+    upright, reversed_ = parts if len(parts) == 2 else (text, "")
+    return _clean(upright), _clean(reversed_)
+
+
+def _paragraphs(lines: list[str]) -> list[str]:
+    return [p for p in re.split(r"\n\s*\n", "\n".join(lines)) if p.strip()]
+
+
+def _alias_patterns(aliases: list[str]) -> tuple[re.Pattern | None, re.Pattern | None]:
+    """
+    Split a card's aliases into a pattern that always applies and one that only applies in a tarot context. A
+    single-word alias is contextual; its "The ..." form always applies, but only capitalised, so "the sun is out"
+    doesn't name a card while "the Sun" does.
+    """
+    always, contextual = [], []
+    for alias in aliases:
+        words = alias.split(" ")
+        if len(words) == 1:
+            contextual.append(re.escape(alias))
+        elif len(words) == 2 and words[0] == "The":
+            always.append(f"[Tt]he {re.escape(words[1])}")
+            contextual.append(re.escape(alias))
+        else:
+            always.append(f"(?i:{re.escape(alias)})")
+    return (
+        re.compile(r"\b(?:" + "|".join(always) + r")\b") if always else None,
+        re.compile(r"\b(?:" + "|".join(contextual) + r")\b", re.IGNORECASE) if contextual else None,
+    )
+
+
+class TarotIndex:
+    """
+    Per-card index of the tarot guide: the symbolism of each card plus its upright, reversed and additional
+    divinatory meanings, parsed once from the Gutenberg text.
+    """
+
+    def __init__(self, cards: list[TarotCard]):
+        self.cards = cards
+        self.by_name = {card.name: card for card in cards}
+        self._patterns = [(card, *_alias_patterns(card.aliases)) for card in cards]
+
+    @classmethod
+    def from_file(cls, path: pathlib.Path) -> "TarotIndex":
+        return cls.parse(path.read_text())
+
+    @classmethod
+    def parse(cls, text: str) -> "TarotIndex":
+        lines = text.split("\n")
+        majors: dict[int, TarotCard] = {}
+        minors: dict[tuple[str, str], TarotCard] = {}
+        current: TarotCard | None = None
+        body: list[str] = []
+
+        def finish():
+            if current is not None and not current.description:
+                description = _clean("\n".join(body))
+                parts = DIVINATORY.split(description, maxsplit=1)
+                if len(parts) == 2:
+                    description, meanings = parts
+                    current.upright, current.reversed = _split_reversed(meanings)
+                current.description = _clean(description)
+
+        section = None
+        for line in lines:
+            stripped = line.strip()
+            if stripped.startswith("SECTION"):
+                finish()
+                current, body = None, []
+                continue
+            if "THEIR DIVINATORY MEANINGS" in stripped:
+                section = "major meanings"
+            elif "ADDITIONAL MEANINGS OF THE LESSER ARCANA" in stripped:
+                section = "minor meanings"
+            elif stripped.startswith("*** END OF"):
+                section = None
+            if section is not None:
+                if current is None:
+                    body.append(line)
+                continue
+
+            major = MAJOR_HEADER.match(stripped)
+            minor = MINOR_HEADER.match(stripped)
+            if major or minor:
+                finish()
+                body = []
+                if major:
+                    number = NUMBER_WORDS.index(major.group(1))
+                    names = [n.strip().title().replace(" Of ", " of ") for n in major.group(2).split(", OR ")]
+                    aliases = names + [n[4:] for n in names if n.startswith("The ")]
+                    aliases += MAJOR_ALIASES.get(names[0], [])
+                    current = majors.setdefault(
+                        number, TarotCard(names[0], f"Greater Arcana {number}", aliases)
+                    )
+                else:
+                    suit, rank = minor.groups()
+                    name = f"{rank.title()} of {suit.title()}"
+                    ranks = [rank.lower()] + ([str(RANK_DIGITS[rank])] if rank in RANK_DIGITS else [])
+                    suits = [suit.lower()] + SUIT_ALIASES[suit]
+                    aliases = [f"{r} of {s}" for r in ranks for s in suits]
+                    current = minors.setdefault((suit, rank), TarotCard(name, f"Lesser Arcana, {suit.title()}", aliases))
+            elif stripped.startswith("[Illustration"):
+                finish()
+                current, body = None, []
+            elif current is not None:
+                body.append(line)
+        finish()
+
+        cls._parse_major_meanings(text, majors)
+        cls._parse_minor_meanings(text, minors)
+        return cls([*[majors[n] for n in sorted(majors)], *minors.values()])
+
+    @staticmethod
+    def _section(text: str, title: str) -> list[str]:
+        start = text.index(title)
+        end = text.find("SECTION", start)
+        return _paragraphs(text[start:end].split("\n")[1:])
+
+    @classmethod
+    def _parse_major_meanings(cls, text: str, majors: dict[int, TarotCard]):
+        for paragraph in cls._section(text, "THE GREATER ARCANA AND THEIR DIVINATORY MEANINGS"):
+            match = MAJOR_MEANING.match(paragraph.strip())
+            if match is None:
+                continue
+            number = int(match.group(1)) if match.group(1) else 0
+            if number in majors:
+                majors[number].upright, majors[number].reversed = _split_reversed(match.group(3))
+
+    @classmethod
+    def _parse_minor_meanings(cls, text: str, minors: dict[tuple[str, str], TarotCard]):
+        suit = rank = None
+        for paragraph in cls._section(text, "SOME ADDITIONAL MEANINGS OF THE LESSER ARCANA"):
+            paragraph = paragraph.strip()
+            if paragraph.rstrip(".") in SUITS:
+                suit = paragraph.rstrip(".")
+                continue
+            if paragraph.startswith("_Reversed_:") and suit is not None and rank is not None:
+                card = minors.get((suit, rank))
+                if card is not None:
+                    card.additional += " Reversed: " + _clean(paragraph[len("_Reversed_:") :])
+                continue
+            match = MINOR_MEANING.match(paragraph)
+            rank = None
+            if match is None or suit is None:
+                continue
+            rank = match.group(1).upper()
+            card = minors.get((suit, rank))
+            if card is not None:
+                upright, reversed_ = _split_reversed(match.group(2))
+                card.additional = upright + (f" Reversed: {reversed_}" if reversed_ else "")
+
+    def find_cards(self, text: str, tarot_context: bool = False) -> list[TarotCard]:
+        """
+        Cards named in `text`, in the order they are first mentioned. Single-word names such as "Sun" or "Death" only
+        count when `text` is known to be about tarot, either through `tarot_context` or words like "card" or "drew".
+        """
+        tarot_context = tarot_context or TAROT_CONTEXT.search(text) is not None
+        found = []
+        for card, pattern, contextual in self._patterns:
+            patterns = [pattern, contextual if tarot_context else None]
+            matches = [m for p in patterns if p is not None and (m := p.search(text))]
+            if matches:
+                found.append((min(m.start() for m in matches), card))
+        found.sort(key=lambda item: item[0])
+        return list(dict.fromkeys(card for _, card in found))
+
+    def passages(self, cards: list[TarotCard], token_budget: int = 3000) -> list[str]:
+        """
+        Reference passages for `cards` within `token_budget`: every card's meanings first, then as much of each
+        card's symbolism as still fits.
+        """
+        passages, used = [], 0
+        for card in cards:
+            meanings = card.meanings()
+            cost = estimate_tokens(meanings)
+            if used + cost > token_budget:
+                break
+            passages.append(meanings)
+            used += cost
+        for i, card in enumerate(cards[: len(passages)]):
+            remaining = (token_budget - used) * 4
+            if remaining <= 200 or not card.description:
+                continue
+            description = card.description[:remaining]
+            passages[i] += f"\nSymbolism: {description}"
+            used += estimate_tokens(description)
+        return passages
@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+# rough average for English prose with OpenAI/Gemini style tokenizers
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str | None) -> int:
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def estimate_message_tokens(messages: list[dict]) -> int:
+    """Estimate the prompt size of OpenAI-style messages, counting only their text parts."""
+    total = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    total += estimate_tokens(part.get("text"))
+    return total
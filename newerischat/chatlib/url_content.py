@@ -1,40 +1,69 @@
+import asyncio
+import os
 import pathlib
 import json
 import hashlib
 
 import openai
-import bs4
 import aiohttp
 from async_lru import alru_cache
-from markdownify import markdownify as md
+
+from . import downloads
+from .retrieval import ChunkIndex
 
 CACHE = pathlib.Path(__file__).parent / "pages"
 
 
 class URLContent:
-    name: str
-    content: str
-    markdown: str
-    hex: str
-    soup: bs4.BeautifulSoup
+    name: str = None
+    content: str = None
+    markdown: str = None
     summary: str = None
+    stats: dict = None
+    etag: str = None
+    last_modified: str = None
 
     def __init__(self, url: str):
-        self.url: str = url
+        self.url: str = downloads.canonicalize_url(url)
+        self.hex: str = hashlib.sha256(self.url.encode("utf-8")).hexdigest()
+
+    @property
+    def content_hash(self) -> str | None:
+        if self.markdown is None:
+            return None
+        return hashlib.sha256(self.markdown.encode("utf-8")).hexdigest()
 
     @alru_cache(maxsize=128)
-    async def fetch(self):
-        async with aiohttp.ClientSession() as session:
-            resp: aiohttp.ClientResponse
-            async with session.get(self.url) as resp:
-                if resp.status != 200:
-                    return
-
-                self.content = await resp.text()
-                self.soup = bs4.BeautifulSoup(self.content, "html.parser")
-                self.markdown = md(self.content)
-                self.name = self.soup.title.string
-                self.hex = hashlib.sha256(self.url.encode("utf-8")).hexdigest()
+    async def fetch(self, max_bytes: int = downloads.MAX_DOWNLOAD_BYTES):
+        """Download and extract the page, raising `downloads.DownloadError` if it can't be fetched."""
+        await self._fetch(max_bytes)
+
+    async def refresh(self, max_bytes: int = downloads.MAX_DOWNLOAD_BYTES) -> bool:
+        """Revalidate the page with a conditional request. Returns whether its extracted content changed."""
+        return await self._fetch(max_bytes, conditional=True)
+
+    async def _fetch(self, max_bytes: int, conditional: bool = False) -> bool:
+        async with aiohttp.ClientSession(timeout=downloads.TIMEOUT) as session:
+            download = await downloads.download(
+                session,
+                self.url,
+                max_bytes=max_bytes,
+                etag=self.etag if conditional else None,
+                last_modified=self.last_modified if conditional else None,
+            )
+        if download.not_modified:
+            return False
+
+        previous_hash = self.content_hash
+        page = await downloads.extract(download)
+        # PDFs are kept as their extracted text, everything else as the decoded document
+        self.content = page.markdown if download.kind == downloads.PDF else download.text
+        self.markdown = page.markdown
+        self.name = page.title
+        self.stats = page.stats
+        self.etag = download.etag
+        self.last_modified = download.last_modified
+        return self.content_hash != previous_hash
 
     async def to_dict(self):
         if self.content is None:
@@ -47,6 +76,9 @@ class URLContent:
             "content": self.content,
             "markdown": self.markdown,
             "summary": self.summary,
+            "stats": self.stats,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
         }
 
     @classmethod
@@ -59,9 +91,16 @@ class URLContent:
         content.markdown = data["markdown"]
         content.name = data.get("name")
         content.summary = data.get("summary")
+        content.stats = data.get("stats")
+        content.etag = data.get("etag")
+        content.last_modified = data.get("last_modified")
         return content
 
-    def format_for_openai(self) -> dict:
+    def format_for_openai(self, excerpts: list[str] | None = None) -> dict:
+        if excerpts is None:
+            body = f"CONTENTS:\n{self.markdown}\n"
+        else:
+            body = "EXCERPTS:\n" + "\n...\n".join(excerpts) + "\n"
         return {
             "role": "user",
             "content": [
@@ -71,8 +110,9 @@ class URLContent:
                         [
                             "---\n",
                             f"NAME OF PAGE: {self.name}\n",
+                            f"URL: {self.url}\n",
                             f"SUMMARY: {self.summary}\n",
-                            f"CONTENTS:\n{self.markdown}\n",
+                            body,
                             "---\n",
                         ]
                     ),
@@ -82,36 +122,200 @@ class URLContent:
 
 
 class ContentStore:
-    def __init__(self, cache_dir: pathlib.Path = CACHE):
+    def __init__(self, cache_dir: pathlib.Path = CACHE, flush_delay: float = 2.0):
         self.cache_dir = cache_dir
         self.cache_dir.mkdir(exist_ok=True, parents=True)
         self.contents: dict[str, URLContent] = {}
+        self.index = ChunkIndex()
+        self.aliases: dict[str, str] = {}
+        self._by_hash: dict[str, str] = {}
+        self.flush_delay = flush_delay
+        self._dirty: set[str] = set()
+        # the pages a running save is writing, taken out of `_dirty` but not yet on disk
+        self._writing: dict[str, URLContent] = {}
+        self._flush_task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+        self._closing = asyncio.Event()
 
-    async def add(self, content: URLContent):
+    def _remember(self, content: URLContent):
         self.contents[content.url] = content
+        if content.content_hash is not None:
+            self._by_hash[content.content_hash] = content.url
+        if content.markdown:
+            self.index.add_page(content.url, content.markdown)
+
+    async def _find_duplicate(self, content: URLContent) -> URLContent | None:
+        url = self._by_hash.get(content.content_hash)
+        if url is None or url == content.url:
+            return None
+        return self.contents.get(url)
+
+    async def add(self, content: URLContent) -> URLContent:
+        """
+        Store a page and return the stored copy. A page whose extracted content matches one already stored is not
+        stored again; its URL becomes an alias of the existing page instead.
+        """
+        duplicate = await self._find_duplicate(content)
+        if duplicate is not None:
+            self.aliases[content.url] = duplicate.url
+            return duplicate
+        self._remember(content)
+        self.mark_dirty(content.url)
+        return content
+
+    def mark_dirty(self, url: str):
+        """
+        Flag a stored page as changed and schedule a background flush. Flushes are coalesced, so marking many pages
+        in quick succession results in a single write pass.
+        """
+        if url not in self.contents:
+            return
+        self._dirty.add(url)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        # keeps going until nothing is dirty, so pages marked during a write and failed writes are picked up too
+        delay = self.flush_delay
+        while self._dirty:
+            try:
+                await asyncio.wait_for(self._closing.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            if await self.save():
+                delay = self.flush_delay
+            elif self._closing.is_set():
+                return
+            else:
+                delay = min(max(delay * 2, 1.0), 60.0)  # back off while writes keep failing
+
+    async def save(self) -> bool:
+        """Write every dirty page to disk. Returns whether all of them were written."""
+        async with self._flush_lock:
+            # the pages are taken along with their URLs, so one leaving `contents` meanwhile is still written
+            self._writing = {url: self.contents[url] for url in self._dirty if url in self.contents}
+            self._dirty = set()
+            written = True
+            try:
+                for url in list(self._writing):
+                    try:
+                        await self._persist(self._writing[url])
+                    except Exception as e:
+                        print(f"Failed to persist {url}: {e}")
+                        self._dirty.add(url)
+                        written = False
+                    del self._writing[url]
+            finally:
+                # anything left over was interrupted before it was written
+                self._dirty.update(self._writing)
+                self._writing = {}
+            return written
+
+    async def _persist(self, content: URLContent):
+        loop = asyncio.get_running_loop()
+        json_content = json.dumps(await content.to_dict())
+        path = self.cache_dir / f"{content.hex}.json"
+        await loop.run_in_executor(None, atomic_write, path, json_content)
+
+    async def close(self):
+        """Write outstanding changes immediately, letting a background flush that is under way finish first."""
+        self._closing.set()
+        if self._flush_task is not None:
+            await self._flush_task
         await self.save()
 
-    async def save(self):
-        for _, content in self.contents.items():
-            json_content = json.dumps(await content.to_dict())
-            (self.cache_dir / f"{content.hex}.json").write_text(json_content)
+    async def load(self):
+        loop = asyncio.get_running_loop()
+        for content in await loop.run_in_executor(None, self._read_files):
+            self._remember(content)
+
+    def _read_files(self) -> list[URLContent]:
+        return [URLContent.from_json(file) for file in self.cache_dir.glob("*.json")]
+
+    def resolve(self, url: str) -> str:
+        """The URL a page is stored under: canonicalised, then followed through any duplicate alias."""
+        url = downloads.canonicalize_url(url)
+        return self.aliases.get(url, url)
+
+    async def get(self, url: str) -> URLContent | None:
+        """Return a stored page without fetching it."""
+        return self.contents.get(self.resolve(url))
+
+    async def refresh_content(self, url: str) -> bool:
+        """
+        Make sure `url` is stored and up to date, using a conditional request if it already is. Returns whether
+        anything new was stored.
+        """
+        content = await self.get(url)
+        if content is None:
+            await self.fetch_content(url)
+            return True
+        validators = (content.etag, content.last_modified)
+        changed = await content.refresh()
+        if changed:
+            content.summary = None  # the old summary describes the old page
+            self._remember(content)
+        # new validators are worth keeping even when the page itself didn't change
+        if changed or (content.etag, content.last_modified) != validators:
+            self.mark_dirty(content.url)
+        return changed
 
-    def load(self):
-        for file in CACHE.glob("*.json"):
-            content = URLContent.from_json(file)
-            self.contents[content.url] = content
+    async def all_urls(self) -> list[str]:
+        return list(self.contents)
+
+    async def read_page(self, url: str) -> dict | None:
+        """The serialised form of a stored page, without keeping it in memory."""
+        content = self.contents.get(url)
+        return None if content is None else await content.to_dict()
+
+    async def import_page(self, data: dict):
+        await self.add(URLContent.from_json(data))
 
     async def fetch_content(self, url: str) -> URLContent:
+        url = self.resolve(url)
         if url in self.contents:
             return self.contents[url]
         else:
             content = URLContent(url)
             await content.fetch()
-            await self.add(content)
-            return content
+            return await self.add(content)
 
     def to_dict(self) -> dict:
         return {url: content.to_dict() for url, content in self.contents.items()}
 
-    def to_openai(self) -> list[dict]:
-        return [content.format_for_openai() for _, content in self.contents.items()]
+    def to_openai(
+        self,
+        query: str | None = None,
+        token_budget: int = 8000,
+        k: int = 40,
+        sent: set[tuple[str, int]] | None = None,
+    ) -> list[dict]:
+        """
+        Format stored pages as model messages. Without a query every page is sent in full; with one, only the
+        `k` best BM25-ranked chunks that fit in `token_budget` are sent, grouped by page in rank order.
+
+        Passing a `sent` set makes retrieval incremental: chunks already in it are skipped and the chunks returned
+        are added to it.
+        """
+        if query is None:
+            return [content.format_for_openai() for _, content in self.contents.items()]
+
+        excerpts: dict[str, list[str]] = {}
+        for chunk in self.index.retrieve(query, token_budget, k=k, exclude=sent):
+            excerpts.setdefault(chunk.url, []).append(chunk.text)
+            if sent is not None:
+                sent.add((chunk.url, chunk.position))
+        return [
+            self.contents[url].format_for_openai(excerpts=texts)
+            for url, texts in excerpts.items()
+        ]
+
+
+def atomic_write(path: pathlib.Path, text: str):
+    # write to a sibling temp file and swap it in so readers never see a partially written page
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)